@@ -1,35 +1,203 @@
 import os
 import socket
-import subprocess
 import threading
 import sys
 import json
+import time
+import heapq
+import queue
+import argparse
+import mmap
+import gzip
+import select
+import sqlite3
 from datetime import datetime, timedelta
 import re
-from collections import Counter
+import math
+from collections import Counter, deque, OrderedDict
+from itertools import islice, chain
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qs, urlencode
+from urllib.request import urlopen
 
-log_file = sys.argv[1] if len(sys.argv) > 1 else '/var/www/api/nginx-logs/site.access.log'
+DEFAULT_LOG_FILE = '/var/www/api/nginx-logs/site.access.log'
 port = 8080
+poll_interval = 0.5  # Период опроса файлов общим тейлером, сек
+poll_chunk_bytes = 4 * 1024 * 1024  # Сколько дочитывать за раз (после простоя хвост может быть большим)
 
-# Хранилище последних логов
-log_history = []
+# Хранилище последних логов (на каждый источник)
 max_history = 10000  # Увеличим для всего файла
 
+LOG_LINE_RE = re.compile(r'(\S+) \S+ \S+ \[([^\]]+)\] "(\S+) (\S+) [^"]+" (\d+) (\d+) "([^"]*)" "([^"]*)"([^\n]*)')
+TIMING_KEY_RE = re.compile(r'\b(rt|urt|request_time|upstream_response_time)=([\d.,: -]+?)(?=\s+\w+=|\s*$)')
+
+minute_cache = {}  # Минута из $time_local -> (для показа, unix-время)
+
+# Классы клиентов по $http_user_agent. Запись несёт только метку "класс/семейство"
+# (один общий объект строки на метку), классификатор вызывается раз на уникальный UA
+UA_CLASSES = ('browser', 'mobile', 'bot', 'tool', 'other')
+# Имя бота - целый продуктовый токен ("Googlebot/2.1", "; bingbot;"), а не часть
+# модели устройства вроде "CUBOT_X30 Build"
+UA_BOT_RE = re.compile(r'(?:^|[\s;(,])([\w.-]*(?:bot|crawler|spider|slurp)[\w.-]*)(?=[/;),]|\s+[\d(+]|$)|'
+                       r'(facebookexternalhit|HeadlessChrome|Lighthouse)', re.I)
+UA_TOOL_RE = re.compile(r'^(?:curl|Wget|python-requests|python-urllib|Python|aiohttp|httpx|Go-http-client|'
+                        r'okhttp|Java|Apache-HttpClient|libwww-perl|PostmanRuntime|HTTPie|axios|node-fetch|'
+                        r'Ruby|PHP|GuzzleHttp|Scrapy|masscan|zgrab|Nmap)', re.I)
+UA_BROWSERS = (('Edg/', 'Edge'), ('OPR/', 'Opera'), ('Opera', 'Opera'), ('YaBrowser/', 'Yandex'),
+               ('SamsungBrowser/', 'Samsung'), ('Firefox/', 'Firefox'), ('FxiOS/', 'Firefox'),
+               ('CriOS/', 'Chrome'), ('Chrome/', 'Chrome'), ('Safari', 'Safari'),
+               ('MSIE ', 'IE'), ('Trident/', 'IE'))
+UA_MOBILE_RE = re.compile(r'Mobi|Android|iPhone|iPad|iPod')
+ua_cache = {}         # UA -> метка; при переполнении очищается
+ua_cache_limit = 100000
+ua_labels = {}        # Интернированные метки "класс/семейство"
+ua_labels_limit = 500  # Семейства сверх лимита (произвольные имена ботов) идут в "класс/Other"
+
+LINE_TIME_RE = re.compile(rb'\[(\d\d/\w{3}/\d{4}:\d\d:\d\d:\d\d)')
+
+# SSE: буфер на клиента, пульс и проверка отключения
+sse_max_buffer = 1024 * 1024   # Клиент, не вычитавший столько, отключается
+sse_stall_timeout = 30         # Сколько клиент может не вычитывать ни байта, сек
+sse_heartbeat = 15             # Комментарий-пульс при тишине в логе, сек
+sse_check_interval = 1.0       # Как часто проверяем, жив ли клиент, сек
+sse_batch = 500                # Строк в одной пачке записи
+
+# Таймлайн: счётчики запросов/4xx/5xx по минутам за весь файл
+MINUTE_STATUS_RE = re.compile(rb'\[(\d\d/\w{3}/\d{4}:\d\d:\d\d):\d\d[^\]]*\] "[^"\n]*" (\d)\d\d ')
+HISTOGRAM_STEPS = (60, 300, 900, 1800, 3600, 3 * 3600, 6 * 3600, 12 * 3600, 86400)
+histogram_scan_chunk = 16 * 1024 * 1024
+
+# Пакетный режим (--batch): запросы к файлам из командной строки, без веб-сервера
+BATCH_COLUMNS = ('time', 'source', 'ip', 'method', 'url', 'status', 'size',
+                 'request_time', 'upstream_time', 'referer', 'agent', 'ua')
+BATCH_TOP_FIELDS = ('ip', 'url', 'route', 'status', 'method', 'referer', 'agent', 'ua')
+batch_chunk_bytes = 16 * 1024 * 1024  # Кусок файла на один процесс-исполнитель
+
+# Кэш результатов /search: LRU, ограничен суммарным числом записей
+query_cache_entries = 200000
+
+# Постоянное хранилище (--db): SQLite в режиме WAL
+store = None
+store_retention_days = 30
+backfill_chunk_bytes = 8 * 1024 * 1024  # Порция первичного импорта файла в базу
+STORE_COLUMNS = ('source', 'ts', 'ip', 'method', 'url', 'status', 'size', 'referer', 'agent',
+                 'request_time', 'upstream_time', 'raw')
+STORE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    ip TEXT, method TEXT, url TEXT, status INTEGER, size INTEGER,
+    referer TEXT, agent TEXT, request_time REAL, upstream_time REAL, raw TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_source_ts ON entries (source, ts);
+CREATE INDEX IF NOT EXISTS entries_source_status_ts ON entries (source, status, ts);
+CREATE INDEX IF NOT EXISTS entries_source_ip_ts ON entries (source, ip, ts);
+CREATE TABLE IF NOT EXISTS sources (
+    name TEXT PRIMARY KEY,
+    path TEXT, inode INTEGER, offset INTEGER,
+    backfill_pos INTEGER DEFAULT 0, backfill_end INTEGER DEFAULT 0
+);
+'''
+
+# Именованные источники: имя -> LogSource
+sources = {}
+ALL_SOURCES = '*'
+
+# Режим сборщика: потоки с других экземпляров вьювера
+reorder_delay = 2.0     # Макс. задержка для упорядочивания строк от разных узлов, сек
+upstream_timeout = 60   # Таймаут чтения /stream узла, после него переподключаемся
+
+# Топ IP/URL/реферов/агентов: Space-Saving скетчи по минутам в скользящем окне
+TOP_FIELDS = ('ip', 'url', 'referer', 'agent')
+top_capacity = 200        # Счётчиков в одном скетче (память не зависит от числа URL)
+top_window_minutes = 60   # Сколько минутных корзин храним
+
+# Активность IP: поминутные счётчики на IP в скользящем окне, холодные IP
+# вытесняются (LRU). В худшем случае ~50 МБ на источник
+CLIENT_SORTS = {'count': 0, 'errors': 1, 'total': 2, 'first_seen': 3, 'last_seen': 4}  # Колонка строки в clients_stats
+client_max_ips = 20000        # IP на источник
+client_window_minutes = 30    # Минут истории на IP
+
+# Латентность: DDSketch-квантили $request_time/$upstream_response_time по маршрутам
+LATENCY_FIELDS = ('request_time', 'upstream_time')
+latency_accuracy = 0.01       # Относительная ошибка квантилей (1%)
+latency_minute_buckets = 60   # Последний час - поминутно
+latency_hour_buckets = 24 * 7 # Дальше - почасовые корзины за неделю
+latency_max_routes = 100      # Маршрутов в корзине, остальные идут в (other)
+
+# Всплески: EWMA-базовые линии по поминутным счётчикам (запросы, классы статусов,
+# максимум запросов с одного IP, популярные маршруты)
+alert_alpha = 0.1         # Вес новой минуты в базовой линии
+alert_threshold = 4.0     # Порог отклонения от базовой линии, в сигмах
+alert_warmup = 15         # Минут наблюдения до первых алертов по ряду
+alert_min_count = 20      # Меньше событий в минуте - не алерт, каким бы ни был рост
+alert_max_routes = 50     # Маршрутов с собственной базовой линией
+alert_max_gap = 60        # Сколько пустых минут подряд подмешивать в базу
+alert_close_delay = 10    # Через сколько секунд после конца минуты закрывать её по часам
+alerts = deque(maxlen=500)
+alert_ids = 0
+# Списки записей несут только колонки таблицы и id; raw, referer и agent
+# читаются из файла по id (/detail) для раскрытия строки, копирования и экспорта
+LIST_FIELDS = ('id', 'ip', 'timestamp', 'sort_time', 'method', 'url', 'status', 'size',
+               'request_time', 'upstream_time', 'source', 'ua')
+ENTRY_OFFSET_BITS = 40      # id = (поколение % 2^13) << 40 | смещение строки: целое, точное в JS
+ENTRY_GENERATION_BITS = 13  # id < 0 - номер строки в базе (--db)
+detail_max_ids = 5000       # id в одном запросе /detail
+detail_window = 256 * 1024  # Соседние строки читаются одним pread, если ближе этого
+detail_line_bytes = 16 * 1024
+max_request_bytes = 1024 * 1024
+
+# Компактный формат передачи (?format=compact для /stream и /full-log)
+WIRE_FIELDS = ('time', 'ip', 'method', 'url', 'status', 'size',
+               'request_time', 'upstream_time', 'source', 'id', 'ua')
+WIRE_DICT_FIELDS = ('ip', 'method', 'url', 'source', 'ua')
+wire_dict_limit = 50000   # Размер словаря поля на соединение, дальше строки идут как есть
+
+ROUTE_ID_RE = re.compile(r'/(?:\d+|[0-9a-fA-F]{16,}|[0-9a-fA-F]{8}-[0-9a-fA-F-]{27})(?=/|$)')
+
+def parse_timings(rest):
+    """Достаёт $request_time и $upstream_response_time из хвоста строки
+
+    Понимает как позиционный хвост "... 0.123 0.100", так и ключи
+    rt=/request_time= и urt=/upstream_response_time=. Несколько апстримов
+    ("0.010, 0.020" или "0.010 : 0.020") суммируются, "-" пропускается.
+    """
+    rest = rest.strip()
+    if not rest:
+        return None, None
+    keyed = dict(TIMING_KEY_RE.findall(rest))
+    if keyed:
+        request_time = keyed.get('rt') or keyed.get('request_time')
+        upstream_time = keyed.get('urt') or keyed.get('upstream_response_time')
+    else:
+        request_time, _, upstream_time = rest.partition(' ')
+        upstream_time = re.match(r'[\d.,: -]*', upstream_time).group()
+    return parse_seconds(request_time), parse_seconds(upstream_time)
+
+def parse_seconds(value):
+    total = None
+    for part in re.split(r'[,:\s]+', value or ''):
+        try:
+            total = (total or 0) + float(part)
+        except ValueError:
+            pass
+    return total
+
 def parse_log_line(line):
     """Парсит строку лога Nginx в структурированный объект"""
     # Формат combined: $remote_addr - $remote_user [$time_local] "$request" $status $body_bytes_sent "$http_referer" "$http_user_agent"
-    pattern = r'(\S+) \S+ \S+ \[([^\]]+)\] "(\S+) (\S+) [^"]+" (\d+) (\d+) "([^"]*)" "([^"]*)"'
-    match = re.search(pattern, line)
+    # Опционально дальше: $request_time $upstream_response_time (или rt=... urt=...)
+    match = LOG_LINE_RE.search(line)
     
     if match:
-        ip, timestamp, method, url, status, size, referer, agent = match.groups()
+        ip, timestamp, method, url, status, size, referer, agent, rest = match.groups()
+        request_time, upstream_time = parse_timings(rest)
         
-        # Конвертируем timestamp в datetime объект
+        # Конвертируем timestamp: формат 11/Feb/2026:13:43:22 +0000
         try:
-            # Формат: 11/Feb/2026:13:43:22 +0000
-            dt = datetime.strptime(timestamp.split(' ')[0], '%d/%b/%Y:%H:%M:%S')
-            formatted_time = dt.strftime('%d.%m.%Y %H:%M')
-            sort_time = dt.timestamp()
+            formatted_time, minute_time = parse_minute(timestamp[:17])
+            sort_time = minute_time + int(timestamp[18:20])
         except:
             formatted_time = timestamp
             sort_time = 0
@@ -45,10 +213,63 @@ def parse_log_line(line):
             'size': size,
             'referer': referer,
             'agent': agent,
+            'ua': classify_agent(agent),
+            'request_time': request_time,
+            'upstream_time': upstream_time,
             'color': get_status_color(int(status))
         }
     return None
 
+def parse_minute(minute):
+    """'11/Feb/2026:13:43' -> ('11.02.2026 13:43', unix-время начала минуты)
+
+    strptime - самая дорогая часть разбора строки, а минута общая для
+    десятков и тысяч строк подряд, поэтому результат кэшируется.
+    """
+    cached = minute_cache.get(minute)
+    if cached is None:
+        if len(minute_cache) >= 100000:
+            minute_cache.clear()
+        dt = datetime.strptime(minute, '%d/%b/%Y:%H:%M')
+        cached = minute_cache[minute] = (dt.strftime('%d.%m.%Y %H:%M'), dt.timestamp())
+    return cached
+
+def classify_agent(agent):
+    """Метка клиента "класс/семейство" по User-Agent, с кэшем по строке UA
+
+    Класс - один из UA_CLASSES. Семейства - браузер (Chrome, Firefox...),
+    имя бота из UA или утилита (curl, python-requests...).
+    """
+    label = ua_cache.get(agent)
+    if label is None:
+        if len(ua_cache) >= ua_cache_limit:
+            ua_cache.clear()
+        label = ua_cache[agent] = ua_label(*classify_agent_uncached(agent))
+    return label
+
+def classify_agent_uncached(agent):
+    match = UA_BOT_RE.search(agent)
+    if match:
+        return 'bot', match.group(match.lastindex)[:40]
+    match = UA_TOOL_RE.match(agent)
+    if match:
+        return 'tool', match.group()
+    for token, family in UA_BROWSERS:
+        if token in agent:
+            return ('mobile' if UA_MOBILE_RE.search(agent) else 'browser'), family
+    if agent.startswith('Mozilla/'):
+        return ('mobile' if UA_MOBILE_RE.search(agent) else 'browser'), 'Other'
+    return 'other', '-' if agent in ('', '-') else 'Other'
+
+def ua_label(cls, family):
+    label = f'{cls}/{family}'
+    interned = ua_labels.get(label)
+    if interned is None:
+        if len(ua_labels) >= ua_labels_limit:
+            label = f'{cls}/Other'
+        interned = ua_labels.setdefault(label, label)
+    return interned
+
 def get_status_color(status):
     if status >= 500:
         return 'color: #ff6b6b; background: #2c1a1a; font-weight: bold;'
@@ -59,47 +280,1621 @@ def get_status_color(status):
     else:
         return 'color: #69db7e; background: #1a2c1a;'
 
-def collect_status_codes():
-    """Собирает все уникальные статусы из всего лог-файла"""
+def open_mmap(path):
+    """mmap файла только для чтения; None для пустого файла"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def collect_status_codes(path):
+    """Собирает все уникальные статусы из всего лог-файла
+
+    Один проход по mmap без декодирования: ищем только ещё не встреченный
+    статус, а после каждой находки исключаем его из шаблона. Так Python
+    делает по итерации на каждый новый код, а не на каждую строку.
+    """
     statuses = set()
     try:
-        with open(log_file, 'r') as f:
-            # Читаем файл построчно для экономии памяти
-            for line in f:
-                match = re.search(r'" (\d{3}) ', line)
-                if match:
-                    statuses.add(int(match.group(1)))
+        mm = open_mmap(path)
+        if mm is None:
+            return statuses
+        with mm:
+            pattern = re.compile(rb'" (\d{3}) ')
+            pos = 0
+            while True:
+                match = pattern.search(mm, pos)
+                if not match:
+                    break
+                statuses.add(int(match.group(1)))
+                pos = match.end()
+                seen = b'|'.join(b'%d ' % code for code in statuses)
+                pattern = re.compile(rb'" (?!' + seen + rb')(\d{3}) ')
     except Exception as e:
         print(f"Ошибка при сборе статусов: {e}")
     
-    # Добавляем самые частые статусы на всякий случай
+    return statuses
+
+def scan_minute_counts(path, end=None):
+    """Счётчики [всего, 4xx, 5xx] по минутам для всего файла (до байта end)
+
+    Строки не декодируются: findall по кускам mmap даёт пары (минута,
+    класс статуса), их считает Counter, а время разбирается один раз на
+    минуту, а не на строку.
+    """
+    pairs = Counter()
+    try:
+        mm = open_mmap(path)
+        if mm is None:
+            return {}
+        with mm:
+            end = len(mm) if end is None else min(end, len(mm))
+            pos = 0
+            while pos < end:
+                stop = mm.rfind(b'\n', pos, min(pos + histogram_scan_chunk, end)) + 1
+                if stop <= pos:
+                    stop = min(pos + histogram_scan_chunk, end)
+                pairs.update(MINUTE_STATUS_RE.findall(mm, pos, stop))
+                pos = stop
+    except Exception as e:
+        print(f"Ошибка построения таймлайна {path}: {e}")
+    counts = {}
+    for (minute, status_class), n in pairs.items():
+        try:
+            key = int(datetime.strptime(minute.decode(), '%d/%b/%Y:%H:%M').timestamp() // 60)
+        except ValueError:
+            continue
+        row = counts.setdefault(key, [0, 0, 0])
+        row[0] += n
+        if status_class == b'4':
+            row[1] += n
+        elif status_class == b'5':
+            row[2] += n
+    return counts
+
+class Timeline:
+    """Поминутные счётчики запросов и ошибок; гистограмма собирается из них"""
+
+    def __init__(self):
+        self.minutes = {}   # минута -> [всего, 4xx, 5xx]
+
+    def merge(self, counts):
+        for minute, (total, c4, c5) in counts.items():
+            row = self.minutes.setdefault(minute, [0, 0, 0])
+            row[0] += total
+            row[1] += c4
+            row[2] += c5
+
+    def add(self, parsed):
+        row = self.minutes.setdefault(int(parsed['sort_time'] // 60), [0, 0, 0])
+        row[0] += 1
+        if 400 <= parsed['status'] < 500:
+            row[1] += 1
+        elif parsed['status'] >= 500:
+            row[2] += 1
+
+    def buckets(self, start=None, end=None, buckets=120):
+        """Гистограмма по корзинам, размер корзины подбирается под интервал"""
+        minutes = self.minutes
+        if not minutes:
+            return {'step': 60, 'points': []}
+        first = (min(minutes) if start is None else int(start // 60)) * 60
+        last = (max(minutes) if end is None else int(end // 60)) * 60 + 60
+        step = next((s for s in HISTOGRAM_STEPS if (last - first) / s <= buckets), HISTOGRAM_STEPS[-1])
+        points = {}
+        for minute, (total, c4, c5) in minutes.items():
+            if not first <= minute * 60 < last:
+                continue
+            key = minute * 60 // step * step
+            point = points.setdefault(key, [key, 0, 0, 0])
+            point[1] += total
+            point[2] += c4
+            point[3] += c5
+        return {'step': step, 'start': first // step * step, 'end': last,
+                'points': [points[key] for key in sorted(points)]}
+
+def histogram(selected, start=None, end=None, buckets=120):
+    """Гистограмма по выбранным источникам"""
+    merged = Timeline()
+    lo = None if start is None else int(start // 60)
+    hi = None if end is None else int(end // 60)
+    for src in selected:
+        with src.lock:
+            merged.merge({minute: row for minute, row in src.timeline.minutes.items()
+                          if (lo is None or minute >= lo) and (hi is None or minute <= hi)})
+    return merged.buckets(start, end, buckets)
+
+def status_bytes_pattern(status):
+    """Шаблон поля статуса в сырой строке: '404', '4xx' или '5xx'"""
+    if re.fullmatch(r'\d{3}', status or ''):
+        return re.compile(b'" ' + status.encode() + b' ')
+    if re.fullmatch(r'[1-5]xx', status or ''):
+        return re.compile(b'" ' + status[0].encode() + rb'\d\d ')
+    return None
+
+class LogQuery:
+    """Нормализованный серверный запрос: фильтры, интервал времени и лимит
+
+    Относительный интервал "последние N минут" (minutes=) хранится как
+    есть, чтобы повторные запросы дашборда давали один ключ кэша.
+    """
+
+    def __init__(self, params):
+        # Подстрока ищется с учётом регистра (bytes.find); icase=1 - без учёта, медленнее (re.I)
+        self.icase = params.get('icase') == '1'
+        self.text = params.get('q') or None
+        self.status = params.get('status') if status_bytes_pattern(params.get('status')) else None
+        self.ip = (params.get('ip') or '').lower() or None
+        self.method = (params.get('method') or '').upper() or None
+        self.minutes = int_param(params, 'minutes', 0, low=0) or None
+        self.start = None if self.minutes else float_param(params, 'start')
+        self.end = float_param(params, 'end')
+        self.limit = int_param(params, 'limit', max_history, high=max_history)
+        self.key = (self.text, self.icase, self.status, self.ip, self.method,
+                    self.minutes, self.start, self.end, self.limit)
+
+    def time_range(self):
+        start = time.time() - self.minutes * 60 if self.minutes else self.start
+        return start, self.end
+
+    def params(self):
+        """Параметры для пересылки запроса на другой узел"""
+        values = {'q': self.text, 'icase': '1' if self.icase else None,
+                  'status': self.status, 'ip': self.ip, 'method': self.method,
+                  'minutes': self.minutes, 'start': self.start, 'end': self.end, 'limit': self.limit}
+        return {name: value for name, value in values.items() if value is not None}
+
+    def patterns(self):
+        """Шаблоны по сырым байтам строки; первый ищется по файлу, остальные проверяются
+
+        Литерал (bytes) ищется через bytes.find - это в разы быстрее re.search
+        по тому же mmap; регулярные выражения остаются для статуса и icase.
+        """
+        patterns = []
+        if self.text and self.icase:
+            patterns.append(re.compile(re.escape(self.text.encode()), re.I))
+        elif self.text:
+            patterns.append(self.text.encode())
+        if self.ip:
+            patterns.append(FirstField(self.ip.encode()))
+        if self.status:
+            patterns.append(status_bytes_pattern(self.status))
+        if self.method:
+            patterns.append(re.compile(b'"' + re.escape(self.method.encode()) + b' '))
+        return patterns
+
+def line_time(mm, pos):
+    """Время строки, начинающейся с pos (как sort_time в parse_log_line)"""
+    match = LINE_TIME_RE.search(mm, pos, mm.find(b'\n', pos))
+    if not match:
+        return None
+    return datetime.strptime(match.group(1).decode(), '%d/%b/%Y:%H:%M:%S').timestamp()
+
+def bisect_time(mm, ts, lo, hi, after=False):
+    """Смещение первой строки в [lo, hi) со временем >= ts (> ts при after)
+
+    Лог пишется по времени, поэтому интервал ищется бинарным поиском
+    по байтам, без чтения строк вне него.
+    """
+    while lo < hi:
+        mid = (lo + hi) // 2
+        pos = mm.rfind(b'\n', lo, mid) + 1 or lo
+        t = line_time(mm, pos)
+        if t is None or t < ts or (after and t == ts):
+            nxt = mm.find(b'\n', pos, hi)
+            if nxt < 0:
+                return hi
+            lo = nxt + 1
+        else:
+            hi = pos
+    return lo
+
+class FirstField(bytes):
+    """Литерал, который должен попасть в первое поле строки ($remote_addr)"""
+
+def find_span(pattern, buf, pos, hi):
+    """(начало, конец) первого совпадения в [pos, hi): bytes - через bytes.find, иначе re"""
+    if isinstance(pattern, FirstField):
+        while True:
+            i = buf.find(pattern, pos, hi)
+            if i < 0:
+                return None
+            if buf.find(b' ', buf.rfind(b'\n', 0, i) + 1, i) < 0:
+                return i, i + len(pattern)
+            pos = buf.find(b'\n', i, hi)  # Совпадение дальше в строке - к следующей
+            if pos < 0:
+                return None
+    if isinstance(pattern, bytes):
+        i = buf.find(pattern, pos, hi)
+        return None if i < 0 else (i, i + len(pattern))
+    match = pattern.search(buf, pos, hi)
+    return match and match.span()
+
+def match_spans(buf, patterns, lo, hi):
+    """(начало, конец) строк в [lo, hi), в которых находятся все шаблоны"""
+    primary, rest = patterns[0], patterns[1:]
+    pos = lo
+    while True:
+        span = find_span(primary, buf, pos, hi)
+        if not span:
+            return
+        start = buf.rfind(b'\n', 0, span[0]) + 1
+        end = buf.find(b'\n', span[1], hi)
+        if end < 0:
+            end = hi
+        if all(find_span(p, buf, start, end) for p in rest):
+            yield start, end
+        pos = end + 1
+
+def scan_log(path, query, offset=0):
+    """Запрос по всему файлу через mmap: декодируются только совпавшие строки
+
+    Ищет с позиции offset до конца последней целой строки. Возвращает
+    записи (новые сверху) и смещение, до которого файл просмотрен, -
+    с него кэш потом дочитывает только новые строки.
+    """
+    start_t, end_t = query.time_range()
+    patterns = query.patterns()
+    matches = deque(maxlen=query.limit)  # Смещения последних совпавших строк
+    logs = []
+    try:
+        mm = open_mmap(path)
+        if mm is None:
+            return logs, 0
+        with mm:
+            scanned = mm.rfind(b'\n') + 1
+            lo, hi = min(offset, scanned), scanned
+            if start_t is not None:
+                lo = bisect_time(mm, start_t, lo, hi)
+            if end_t is not None:
+                hi = bisect_time(mm, end_t, lo, hi, after=True)
+            if patterns:
+                matches.extend(match_spans(mm, patterns, lo, hi))
+            else:
+                # Без фильтров - просто последние строки интервала
+                end = hi - 1
+                while end >= lo and len(matches) < query.limit:
+                    start = max(mm.rfind(b'\n', lo, end) + 1, lo)
+                    matches.appendleft((start, end))
+                    end = start - 1
+            for start, end in reversed(matches):
+                parsed = parse_log_line(mm[start:end].decode('utf-8', errors='replace') + '\n')
+                if not parsed:
+                    continue
+                parsed['offset'] = start
+                # Строки на границе интервала могут быть чуть не по порядку
+                if start_t is not None and parsed['sort_time'] < start_t:
+                    continue
+                if end_t is not None and parsed['sort_time'] > end_t:
+                    continue
+                logs.append(parsed)
+    except Exception as e:
+        print(f"Ошибка поиска в {path}: {e}")
+        return logs, offset
+    return logs, scanned
+
+def with_common_statuses(statuses):
+    """Добавляет самые частые статусы на всякий случай"""
     common_statuses = [200, 201, 301, 302, 304, 400, 401, 403, 404, 405, 429, 500, 502, 503, 504]
-    for status in common_statuses:
-        statuses.add(status)
-    
-    return sorted(statuses)
+    return sorted(set(statuses) | set(common_statuses))
+
+class QueryCache:
+    """LRU результатов запросов с вытеснением по суммарному числу записей"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.items = OrderedDict()   # ключ -> (inode, offset, tail_time, logs)
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is not None:
+                self.items.move_to_end(key)
+            return item
+
+    def put(self, key, item):
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.size -= len(old[3])
+            self.items[key] = item
+            self.size += len(item[3])
+            while self.size > self.max_entries and len(self.items) > 1:
+                _, evicted = self.items.popitem(last=False)
+                self.size -= len(evicted[3])
+
+query_cache = QueryCache(query_cache_entries)
+
+def entry_row(parsed):
+    return (parsed['source'], int(parsed['sort_time']), parsed['ip'], parsed['method'], parsed['url'],
+            parsed['status'], int(parsed['size']), parsed['referer'], parsed['agent'],
+            parsed.get('request_time'), parsed.get('upstream_time'), parsed['raw'])
+
+def row_entry(row):
+    """Строка таблицы entries (id, затем STORE_COLUMNS) -> запись в формате parse_log_line"""
+    values = dict(zip(STORE_COLUMNS, row[1:]))
+    ts = values.pop('ts')
+    return dict(values,
+                id=-row[0],
+                timestamp=datetime.fromtimestamp(ts).strftime('%d.%m.%Y %H:%M'),
+                sort_time=float(ts),
+                size=str(values['size']),
+                ua=classify_agent(values['agent'] or ''),
+                color=get_status_color(values['status']))
+
+def entry_generation(inode, truncations):
+    """Поколение файла для id: меняется при ротации (inode) и при обрезании"""
+    return (inode + truncations) % (1 << ENTRY_GENERATION_BITS)
+
+def entry_id(inode, offset, truncations=0):
+    """id записи из файла: поколение файла и смещение начала строки"""
+    return entry_generation(inode, truncations) << ENTRY_OFFSET_BITS | offset
+
+def list_entry(parsed):
+    """Запись для списков: колонки таблицы и id, без raw/referer/agent"""
+    return {field: parsed[field] for field in LIST_FIELDS if field in parsed}
+
+def read_lines(path, offsets):
+    """Строки файла по смещениям их начала за один проход
+
+    Смещения сортируются, соседние строки читаются одним os.pread.
+    Смещение, которое не попадает на начало строки, пропускается.
+    """
+    lines = {}
+    offsets = sorted(set(offsets))
+    with open(path, 'rb') as f:
+        fd = f.fileno()
+        i = 0
+        while i < len(offsets):
+            j = i
+            while j + 1 < len(offsets) and offsets[j + 1] - offsets[i] < detail_window:
+                j += 1
+            # Байт перед первой строкой - для проверки, что это начало строки
+            base = max(offsets[i] - 1, 0)
+            buf = os.pread(fd, offsets[j] - base + detail_line_bytes, base)
+            for offset in offsets[i:j + 1]:
+                pos = offset - base
+                if offset and buf[pos - 1:pos] != b'\n':
+                    continue
+                end = buf.find(b'\n', pos)
+                if end < 0:
+                    line = os.pread(fd, max_request_bytes, offset).split(b'\n', 1)[0]
+                else:
+                    line = buf[pos:end]
+                if line:
+                    lines[offset] = line
+            i = j + 1
+    return lines
+
+def like_pattern(text):
+    return '%' + re.sub(r'([\\%_])', r'\\\1', text) + '%'
+
+class EntryStore:
+    """Постоянное хранилище записей в SQLite
+
+    Запись идёт одним соединением: тейлер сбрасывает накопленные строки
+    пакетом в одной транзакции вместе с позицией файла, поэтому после
+    перезапуска чтение продолжается с сохранённого смещения. Чтение -
+    отдельными соединениями (WAL не блокирует читателей).
+    """
+
+    def __init__(self, path, retention_days):
+        self.path = path
+        self.retention = retention_days * 86400
+        self.pending = []
+        self.lock = threading.Lock()        # Для pending
+        self.write_lock = threading.Lock()  # Для транзакций на self.db
+        self.backfilling = set()            # Источники, чья история ещё импортируется
+        self.last_purge = 0
+        self.db = self.connect()
+        self.db.executescript(STORE_SCHEMA)
+
+    def connect(self):
+        db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    def add(self, parsed):
+        with self.lock:
+            self.pending.append(entry_row(parsed))
+
+    def flush(self, local_sources):
+        """Пакетная запись накопленных строк и позиций файлов"""
+        with self.lock:
+            rows, self.pending = self.pending, []
+        states = [(src.path, src.inode, src.offset - len(src.partial), src.name) for src in local_sources]
+        with self.write_lock, self.db:
+            self.db.executemany(f'INSERT INTO entries ({", ".join(STORE_COLUMNS)}) '
+                                f'VALUES ({", ".join("?" * len(STORE_COLUMNS))})', rows)
+            self.db.executemany('UPDATE sources SET path = ?, inode = ?, offset = ? WHERE name = ?', states)
+            if time.time() - self.last_purge > 3600:
+                self.last_purge = time.time()
+                cutoff = int(time.time() - self.retention)
+                for src in local_sources:
+                    self.db.execute('DELETE FROM entries WHERE source = ? AND ts < ?', (src.name, cutoff))
+
+    def state(self, name):
+        """(inode, offset, backfill_pos, backfill_end) источника или None"""
+        return self.db.execute('SELECT inode, offset, backfill_pos, backfill_end FROM sources WHERE name = ?',
+                               (name,)).fetchone()
+
+    def complete(self, name):
+        """Есть ли в базе вся история источника (фоновый импорт закончен)"""
+        return name not in self.backfilling
+
+    def reset(self, src, backfill_end):
+        """Новый или ротированный файл: запоминаем позицию и что импортировать"""
+        if backfill_end:
+            self.backfilling.add(src.name)
+        else:
+            self.backfilling.discard(src.name)
+        with self.write_lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO sources (name, path, inode, offset, backfill_pos, backfill_end) '
+                            'VALUES (?, ?, ?, ?, 0, ?)', (src.name, src.path, src.inode, src.offset, backfill_end))
+
+    def backfill(self, src, pos, end):
+        """Фоновый импорт уже существующей части файла порциями"""
+        print(f"🗄️ {src.name}: импорт {end - pos} байт в базу...")
+        self.backfilling.add(src.name)
+        try:
+            with open(src.path, 'rb') as f:
+                f.seek(pos)
+                while pos < end:
+                    chunk = f.read(min(backfill_chunk_bytes, end - pos))
+                    if not chunk:
+                        break
+                    cut = chunk.rfind(b'\n') + 1 if pos + len(chunk) < end else len(chunk)
+                    chunk = chunk[:cut or len(chunk)]
+                    f.seek(pos + len(chunk))
+                    rows = []
+                    for raw in chunk.split(b'\n'):
+                        parsed = parse_log_line(raw.decode('utf-8', errors='replace') + '\n')
+                        if parsed:
+                            parsed['source'] = src.name
+                            rows.append(entry_row(parsed))
+                    pos += len(chunk)
+                    with self.write_lock, self.db:
+                        self.db.executemany(f'INSERT INTO entries ({", ".join(STORE_COLUMNS)}) '
+                                            f'VALUES ({", ".join("?" * len(STORE_COLUMNS))})', rows)
+                        self.db.execute('UPDATE sources SET backfill_pos = ? WHERE name = ?', (pos, src.name))
+            self.backfilling.discard(src.name)
+            print(f"🗄️ {src.name}: импорт в базу завершён")
+        except Exception as e:
+            print(f"Ошибка импорта {src.path} в базу: {e}")
+
+    def recent(self, name, limit):
+        """Последние записи источника, новые сверху"""
+        db = self.connect()
+        try:
+            rows = db.execute(f'SELECT id, {", ".join(STORE_COLUMNS)} FROM entries WHERE source = ? '
+                              f'ORDER BY ts DESC, id DESC LIMIT ?', (name, limit)).fetchall()
+            return [row_entry(row) for row in rows]
+        finally:
+            db.close()
+
+    def minute_counts(self, name):
+        """Поминутные счётчики для таймлайна (по индексу source, ts)"""
+        db = self.connect()
+        try:
+            rows = db.execute('SELECT ts / 60, COUNT(*), SUM(status BETWEEN 400 AND 499), SUM(status >= 500) '
+                              'FROM entries WHERE source = ? GROUP BY ts / 60', (name,))
+            return {minute: [total, c4, c5] for minute, total, c4, c5 in rows}
+        finally:
+            db.close()
+
+    def statuses(self, name):
+        db = self.connect()
+        try:
+            return {row[0] for row in db.execute('SELECT DISTINCT status FROM entries WHERE source = ?', (name,))}
+        finally:
+            db.close()
+
+    def query(self, name, query):
+        """LogQuery по базе, новые сверху"""
+        where, args = ['source = ?'], [name]
+        if query.text and query.icase:
+            where.append("raw LIKE ? ESCAPE '\\'")
+            args.append(like_pattern(query.text))
+        elif query.text:
+            where.append('instr(raw, ?) > 0')
+            args.append(query.text)
+        if query.ip:
+            where.append("ip LIKE ? ESCAPE '\\'")
+            args.append(like_pattern(query.ip))
+        if query.status and query.status.endswith('xx'):
+            where.append('status BETWEEN ? AND ?')
+            args += [int(query.status[0]) * 100, int(query.status[0]) * 100 + 99]
+        elif query.status:
+            where.append('status = ?')
+            args.append(int(query.status))
+        if query.method:
+            where.append('method = ?')
+            args.append(query.method)
+        start_t, end_t = query.time_range()
+        if start_t is not None:
+            where.append('ts >= ?')
+            args.append(start_t)
+        if end_t is not None:
+            where.append('ts <= ?')
+            args.append(end_t)
+        db = self.connect()
+        try:
+            rows = db.execute(f'SELECT id, {", ".join(STORE_COLUMNS)} FROM entries WHERE {" AND ".join(where)} '
+                              f'ORDER BY ts DESC, id DESC LIMIT ?', args + [query.limit]).fetchall()
+            return [row_entry(row) for row in rows]
+        finally:
+            db.close()
+
+    def details(self, name, rowids):
+        """Полные записи по номерам строк базы"""
+        db = self.connect()
+        try:
+            rows = db.execute(f'SELECT id, {", ".join(STORE_COLUMNS)} FROM entries '
+                              f'WHERE source = ? AND id IN ({", ".join("?" * len(rowids))})',
+                              [name] + list(rowids)).fetchall()
+            return [row_entry(row) for row in rows]
+        finally:
+            db.close()
+
+def load_full_log(path):
+    """Загружает последние max_history записей, читая mmap с конца
 
-def load_full_log():
-    """Загружает ВЕСЬ лог-файл с пагинацией"""
+    Декодируются только нужные строки, весь файл в память не попадает.
+    """
     logs = []
     try:
-        with open(log_file, 'r') as f:
-            # Читаем весь файл
-            lines = f.readlines()
-            print(f"📚 Загружено {len(lines)} строк из лог-файла")
-            
-            # Парсим все строки с конца (новые сверху)
-            for line in reversed(lines):
-                parsed = parse_log_line(line)
+        mm = open_mmap(path)
+        if mm is None:
+            return logs
+        with mm:
+            end = len(mm)
+            if mm[end - 1:end] == b'\n':
+                end -= 1
+            # Парсим строки с конца (новые сверху)
+            while end >= 0 and len(logs) < max_history:
+                start = mm.rfind(b'\n', 0, end) + 1
+                parsed = parse_log_line(mm[start:end].decode('utf-8', errors='replace') + '\n')
                 if parsed:
+                    parsed['offset'] = start
                     logs.append(parsed)
-                    if len(logs) >= max_history:
-                        break
+                end = start - 1
+        print(f"📚 Загружено {len(logs)} записей из лог-файла {path}")
     except Exception as e:
         print(f"Ошибка при загрузке лога: {e}")
     
     return logs
 
+class LogSource:
+    """Именованный лог-файл: индекс последних записей, статусы и подписчики"""
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.entries = deque(maxlen=max_history)  # Старые слева, новые справа
+        self.status_codes = set()
+        self.top = HeavyHitters()
+        self.latency = LatencyIndex()
+        self.clients = ClientTracker()
+        self.timeline = Timeline()
+        self.monitor = AnomalyMonitor(name)
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.offset = 0
+        self.inode = None
+        self.truncations = 0   # Обрезаний на месте (copytruncate): старые id не указывают в новый файл
+        self.partial = b''
+        self.catch_up_end = 0  # Строки до этого смещения - пропущенные за время простоя
+
+    persist = True  # Писать ли строки в store (--db)
+
+    def load(self):
+        """Первичная загрузка: индекс строится один раз, а не на каждый запрос"""
+        if store is not None and self.resume():
+            return
+        try:
+            st = os.stat(self.path)
+            self.inode, self.offset = st.st_ino, st.st_size
+        except OSError as e:
+            print(f"Ошибка при открытии {self.path}: {e}")
+        statuses = collect_status_codes(self.path)
+        counts = scan_minute_counts(self.path, self.offset)
+        logs = load_full_log(self.path)
+        with self.lock:
+            self.status_codes |= statuses
+            self.timeline.merge(counts)
+            for parsed in reversed(logs):
+                parsed['source'] = self.name
+                parsed['id'] = entry_id(self.inode, parsed.pop('offset'), self.truncations)
+                self.entries.append(list_entry(parsed))
+                self.index(parsed)
+                self.monitor.add(parsed)  # Разогрев базовых линий, алерты истории не публикуются
+        if store is not None:
+            # Уже записанная часть файла уходит в базу фоном, новое - через тейлер
+            store.reset(self, backfill_end=self.offset)
+            threading.Thread(target=store.backfill, args=(self, 0, self.offset), daemon=True).start()
+
+    def resume(self):
+        """Быстрый старт из базы, если файл тот же и не обрезан"""
+        state = store.state(self.name)
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+        if state is None or state[0] != st.st_ino or st.st_size < state[1]:
+            return False
+        self.inode, self.offset = state[0], state[1]
+        self.catch_up_end = st.st_size
+        logs = store.recent(self.name, max_history)
+        backfill_pos, backfill_end = state[2], state[3]
+        # Пока импорт не закончен, в базе нет начала файла - считаем таймлайн по файлу
+        if backfill_pos < backfill_end:
+            counts = scan_minute_counts(self.path, self.offset)
+        else:
+            counts = store.minute_counts(self.name)
+        with self.lock:
+            self.status_codes |= store.statuses(self.name)
+            self.timeline.merge(counts)
+            for parsed in reversed(logs):
+                self.entries.append(list_entry(parsed))
+                self.index(parsed)
+                self.monitor.add(parsed)
+        print(f"♻️ {self.name}: {len(logs)} записей из базы, дочитываем с байта {self.offset}")
+        if backfill_pos < backfill_end:
+            threading.Thread(target=store.backfill, args=(self, backfill_pos, backfill_end), daemon=True).start()
+        return True
+
+    def poll(self):
+        """Дочитывает новые строки с последней позиции (аналог tail -F)"""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return
+        if st.st_ino != self.inode or st.st_size < self.offset:
+            # Файл ротирован или обрезан - читаем новый с начала
+            if st.st_ino == self.inode:
+                self.truncations += 1
+            self.inode, self.offset, self.partial = st.st_ino, 0, b''
+            self.catch_up_end = 0
+            if store is not None and self.persist:
+                store.reset(self, backfill_end=0)
+        if st.st_size == self.offset:
+            return
+        with open(self.path, 'rb') as f:
+            f.seek(self.offset)
+            # Кусками: после долгого простоя хвост не читается в память целиком
+            while self.offset < st.st_size:
+                chunk = f.read(min(poll_chunk_bytes, st.st_size - self.offset))
+                if not chunk:
+                    break
+                start = self.offset - len(self.partial)  # Смещение первой строки куска
+                self.offset += len(chunk)
+                *lines, self.partial = (self.partial + chunk).split(b'\n')
+                for raw in lines:
+                    parsed = parse_log_line(raw.decode('utf-8', errors='replace') + '\n')
+                    if parsed:
+                        parsed['source'] = self.name
+                        parsed['id'] = entry_id(self.inode, start, self.truncations)
+                        # Пропущенное за простой - разогрев, а не живой поток
+                        self.ingest(parsed, live=start >= self.catch_up_end)
+                    start += len(raw) + 1
+                if store is not None and self.persist and self.offset < st.st_size:
+                    store.flush([src for src in sources.values() if src.persist])
+
+    def index(self, parsed):
+        """Обновляет агрегаты источника по новой строке (вызывать под lock)"""
+        self.status_codes.add(parsed['status'])
+        self.top.add(parsed)
+        self.latency.add(parsed)
+        self.clients.add(parsed)
+
+    def ingest(self, parsed, live=True):
+        """Новая строка в индекс и базу; live=False - без подписчиков и алертов"""
+        if store is not None and self.persist:
+            store.add(parsed)
+        with self.lock:
+            self.entries.append(list_entry(parsed))
+            self.index(parsed)
+            self.timeline.add(parsed)
+            found = self.monitor.add(parsed)
+            subscribers = list(self.subscribers)
+        if not live:
+            return
+        for q in subscribers:
+            try:
+                q.put_nowait(parsed)
+            except queue.Full:
+                pass  # Медленный клиент пропускает строки, а не тормозит тейлер
+        if found:
+            publish_alerts(found, subscribers)
+
+    def tick(self, now):
+        """Закрывает минуты детекторов по часам, даже если строк больше нет"""
+        with self.lock:
+            found = self.monitor.tick(now)
+            subscribers = list(self.subscribers)
+        if found:
+            publish_alerts(found, subscribers)
+
+    def subscribe(self, q):
+        with self.lock:
+            self.subscribers.add(q)
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.subscribers.discard(q)
+
+    def search(self, query):
+        """Запрос по всему файлу с кэшем результатов
+
+        Ключ - нормализованный запрос, в кэше - поколение файла. Интервал,
+        закончившийся до хвоста файла, отдаётся из кэша как есть; открытый
+        интервал дочитывает только строки, дописанные после прошлого запроса.
+        С --db запрос идёт в базу, но пока импорт истории не закончен - по файлу.
+        """
+        if store is not None and store.complete(self.name):
+            return [list_entry(parsed) for parsed in store.query(self.name, query)]
+        key = (self.name,) + query.key
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return []
+        inode, truncations = st.st_ino, self.truncations
+        cached = query_cache.get(key)
+        # Файл короче просмотренного - обрезан (copytruncate): новое поколение, как в poll()
+        if cached is not None and cached[0] == (inode, truncations) and st.st_size >= cached[1]:
+            _, offset, tail_time, logs = cached
+            start_t, end_t = query.time_range()
+            if end_t is None or end_t >= tail_time:
+                new, offset = scan_log(self.path, query, offset)
+                logs = new + logs
+                if start_t is not None:
+                    logs = [e for e in logs if e['sort_time'] >= start_t]
+                logs = logs[:query.limit]
+        else:
+            logs, offset = scan_log(self.path, query)
+        for parsed in logs:
+            if 'offset' in parsed:
+                parsed['id'] = entry_id(inode, parsed['offset'], truncations)
+                parsed['source'] = self.name
+        logs = [list_entry(parsed) for parsed in logs]
+        with self.lock:
+            tail_time = self.entries[-1]['sort_time'] if self.entries else 0
+        query_cache.put(key, ((inode, truncations), offset, tail_time, logs))
+        return logs
+
+    def details(self, ids):
+        """Полные записи (raw, referer, agent) по id из списков
+
+        Строки текущего файла читаются по смещениям одним проходом, строки
+        из базы - одним запросом. id ротированного или обрезанного файла
+        не находятся.
+        """
+        found = []
+        rowids = [-i for i in ids if i < 0]
+        if rowids and store is not None:
+            found += store.details(self.name, rowids)
+        try:
+            inode = os.stat(self.path).st_ino
+        except OSError:
+            return found
+        truncations = self.truncations
+        generation = entry_generation(inode, truncations)
+        offsets = [i & ((1 << ENTRY_OFFSET_BITS) - 1) for i in ids
+                   if i >= 0 and i >> ENTRY_OFFSET_BITS == generation]
+        if not offsets:
+            return found
+        try:
+            lines = read_lines(self.path, offsets)
+        except OSError as e:
+            print(f"Ошибка чтения строк {self.path}: {e}")
+            return found
+        for offset, raw in lines.items():
+            parsed = parse_log_line(raw.decode('utf-8', errors='replace') + '\n')
+            if parsed:
+                parsed['id'] = entry_id(inode, offset, truncations)
+                parsed['source'] = self.name
+                found.append(parsed)
+        return found
+
+    def snapshot(self):
+        """Копия индекса, новые записи сверху"""
+        with self.lock:
+            return list(reversed(self.entries))
+
+class ReorderBuffer:
+    """Сливает потоки нескольких узлов по времени с ограниченной задержкой"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.heap = []              # (sort_time, seq, src, parsed)
+        self.arrivals = deque()     # (момент прихода, sort_time) в порядке прихода
+        self.release_until = 0
+        self.seq = 0
+        self.lock = threading.Lock()
+
+    def push(self, src, parsed):
+        with self.lock:
+            heapq.heappush(self.heap, (parsed['sort_time'], self.seq, src, parsed))
+            self.arrivals.append((time.monotonic(), parsed['sort_time']))
+            self.seq += 1
+
+    def flush(self):
+        """Отдаёт по времени всё, что не новее строк, продержанных delay секунд
+
+        Пока отставание узлов друг от друга меньше delay, общий поток
+        получается упорядоченным, а задержка отображения не больше delay.
+        """
+        now = time.monotonic()
+        with self.lock:
+            while self.arrivals and now - self.arrivals[0][0] >= self.delay:
+                self.release_until = max(self.release_until, self.arrivals.popleft()[1])
+            while self.heap and self.heap[0][0] <= self.release_until:
+                _, _, src, parsed = heapq.heappop(self.heap)
+                src.ingest(parsed)
+
+reorder_buffer = ReorderBuffer(reorder_delay)
+
+class RemoteSource(LogSource):
+    """Лог другого экземпляра вьювера: история через /full-log, хвост через /stream"""
+
+    persist = False  # Историю хранит сам узел, поиск тоже пересылается ему
+
+    def __init__(self, name, url):
+        parts = urlsplit(url)
+        super().__init__(name, url)
+        self.base_url = f'{parts.scheme or "http"}://{parts.netloc}'
+        self.remote_source = parse_qs(parts.query).get('source', [ALL_SOURCES])[-1]
+        self.upstream_ids = OrderedDict()  # свой id -> (источник на узле, id на узле)
+        self.local_ids = {}                # (источник на узле, id на узле) -> свой id
+        self.next_id = 0
+        self.id_lock = threading.Lock()
+
+    def url(self, endpoint, **params):
+        return f'{self.base_url}{endpoint}?{urlencode(dict(params, source=self.remote_source))}'
+
+    def adopt(self, parsed):
+        """Запись с узла получает свой id; детали потом запрашиваются у узла
+
+        Повторно пришедшая запись (поиск, перезагрузка) получает прежний id,
+        поэтому поиски не вытесняют id строк, уже показанных на странице.
+        """
+        origin = (parsed.get('source'), parsed.get('id'))
+        with self.id_lock:
+            if origin[1] is None:
+                local = None
+            elif origin in self.local_ids:
+                local = self.local_ids[origin]
+                self.upstream_ids.move_to_end(local)
+            else:
+                self.next_id += 1
+                local = self.next_id
+                self.upstream_ids[local] = origin
+                self.local_ids[origin] = local
+                if len(self.upstream_ids) > max_history * 4:
+                    _, evicted = self.upstream_ids.popitem(last=False)
+                    del self.local_ids[evicted]
+            parsed['id'] = local
+        parsed['source'] = self.name
+        return parsed
+
+    def details(self, ids):
+        """Полные записи пересылкой /detail на узел, по источникам узла"""
+        wanted = {}
+        with self.id_lock:
+            for i in ids:
+                origin = self.upstream_ids.get(i)
+                if origin is not None:
+                    wanted.setdefault(origin[0], {})[origin[1]] = i
+        found = []
+        for origin, mapping in wanted.items():
+            body = urlencode({'source': origin, 'ids': ','.join(map(str, mapping))}).encode()
+            try:
+                with urlopen(f'{self.base_url}/detail', body, timeout=upstream_timeout) as resp:
+                    details = json.load(resp)
+            except Exception as e:
+                print(f"Ошибка запроса деталей с {self.base_url}: {e}")
+                continue
+            for parsed in details:
+                parsed['id'] = mapping.get(parsed.get('id'))
+                parsed['source'] = self.name
+                found.append(parsed)
+        return found
+
+    def minute_counts(self):
+        """Поминутные счётчики всей истории узла из его /histogram
+
+        За один запрос узел отдаёт до 1000 корзин; если вся история длиннее
+        1000 минут, она запрашивается окнами по 1000 минут.
+        """
+        def fetch(**params):
+            with urlopen(self.url('/histogram', buckets=1000, **params), timeout=upstream_timeout) as resp:
+                return json.load(resp)
+        counts = {}
+        result = fetch()
+        if not result['points']:
+            return counts
+        windows = [result]
+        if result['step'] > 60:
+            windows = (fetch(start=start, end=start + 999 * 60)
+                       for start in range(result['start'], result['end'], 1000 * 60))
+        for window in windows:
+            for key, total, c4, c5 in window['points']:
+                counts[key // 60] = (total, c4, c5)
+        return counts
+
+    def load(self):
+        try:
+            # Полные записи: топы по referer/agent считаются и здесь
+            with urlopen(self.url('/full-log', fields='full'), timeout=upstream_timeout) as resp:
+                logs = json.load(resp)
+        except Exception as e:
+            print(f"Ошибка загрузки истории с {self.base_url}: {e}")
+            logs = []
+        # Таймлайн - по всей истории узла, а не только по max_history последних строк
+        try:
+            counts = self.minute_counts()
+        except Exception as e:
+            print(f"Ошибка загрузки гистограммы с {self.base_url}: {e}")
+            counts = None
+        with self.lock:
+            if counts is not None:
+                self.timeline.merge(counts)
+            for parsed in reversed(logs):
+                self.adopt(parsed)
+                self.entries.append(list_entry(parsed))
+                self.index(parsed)
+                self.monitor.add(parsed)
+                if counts is None:
+                    self.timeline.add(parsed)
+        threading.Thread(target=self.follow, daemon=True).start()
+
+    def poll(self):
+        pass  # Новые строки приходят из потока follow
+
+    def search(self, query):
+        """Поиск (и его кэш) выполняет сам узел по своему файлу"""
+        params = urlencode(dict(query.params(), source=self.remote_source))
+        try:
+            with urlopen(f'{self.base_url}/search?{params}', timeout=upstream_timeout) as resp:
+                logs = json.load(resp)
+        except Exception as e:
+            print(f"Ошибка поиска на {self.base_url}: {e}")
+            return []
+        return [list_entry(self.adopt(parsed)) for parsed in logs]
+
+    def follow(self):
+        """Подписка на /stream узла с переподключением"""
+        while True:
+            try:
+                with urlopen(self.url('/stream', fields='full'), timeout=upstream_timeout) as resp:
+                    # Алерты узла (event: alert) пропускаем: свой детектор сборщика
+                    # считает их по тем же строкам
+                    event = 'message'
+                    for line in resp:
+                        if line.startswith(b'event:'):
+                            event = line[6:].strip().decode()
+                        elif line.startswith(b'data: '):
+                            if event == 'message':
+                                reorder_buffer.push(self, self.adopt(json.loads(line[6:])))
+                        elif not line.strip():
+                            event = 'message'  # Пустая строка завершает событие
+            except socket.timeout:
+                pass  # Тихий узел - просто переподключаемся
+            except Exception as e:
+                print(f"Поток {self.base_url} прерван: {e}")
+            time.sleep(1)
+
+class SpaceSaving:
+    """Space-Saving: приближённый top-K в фиксированной памяти
+
+    Хранит не больше capacity счётчиков; новое значение вытесняет самое
+    редкое и наследует его счёт как оценку ошибки сверху.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}   # значение -> [счёт, ошибка]
+        self.heap = []     # (счёт, значение), счёт может отставать от counts
+
+    def add(self, item):
+        entry = self.counts.get(item)
+        if entry is not None:
+            entry[0] += 1
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[item] = [1, 0]
+            heapq.heappush(self.heap, (1, item))
+            return
+        # Ленивая куча: устаревшие счёты обновляем, пока не найдём настоящий минимум
+        while True:
+            count, victim = heapq.heappop(self.heap)
+            actual = self.counts[victim][0]
+            if actual == count:
+                break
+            heapq.heappush(self.heap, (actual, victim))
+        del self.counts[victim]
+        self.counts[item] = [count + 1, count]
+        heapq.heappush(self.heap, (count + 1, item))
+
+class HeavyHitters:
+    """Скетчи Space-Saving по полям в минутных корзинах скользящего окна"""
+
+    def __init__(self):
+        self.buckets = {}   # минута -> {поле: SpaceSaving}
+        self.latest = 0
+
+    def add(self, parsed):
+        minute = int(parsed['sort_time'] // 60)
+        if minute <= self.latest - top_window_minutes:
+            return
+        bucket = self.buckets.get(minute)
+        if bucket is None:
+            bucket = self.buckets[minute] = {field: SpaceSaving(top_capacity) for field in TOP_FIELDS}
+            if minute > self.latest:
+                self.latest = minute
+                for old in [m for m in self.buckets if m <= minute - top_window_minutes]:
+                    del self.buckets[old]
+        for field in TOP_FIELDS:
+            value = parsed.get(field)
+            if field == 'url' and value:
+                value = value.split('?', 1)[0]
+            if value and value != '-':
+                bucket[field].add(value)
+
+    def merge_into(self, field, minutes, counts, errors):
+        """Суммирует корзины последних minutes минут в Counter'ы"""
+        for minute, bucket in self.buckets.items():
+            if minute > self.latest - minutes:
+                for value, (count, error) in bucket[field].counts.items():
+                    counts[value] += count
+                    errors[value] += error
+
+class ClientStats:
+    """Активность одного IP: первое/последнее появление, классы статусов, минуты"""
+    __slots__ = ('first_seen', 'last_seen', 'total', 'classes', 'minutes')
+
+    def __init__(self, t):
+        self.first_seen = self.last_seen = t
+        self.total = 0
+        self.classes = [0] * 6          # 1xx..5xx по индексу status // 100
+        self.minutes = deque()          # [минута, запросы, ошибки], старые слева
+
+    def add(self, t, status):
+        minute = int(t // 60)
+        self.total += 1
+        self.classes[min(status // 100, 5)] += 1
+        if t > self.last_seen:
+            self.last_seen = t
+        elif t < self.first_seen:
+            self.first_seen = t
+        # Строка чуть не по порядку засчитывается в последнюю минуту
+        if not self.minutes or self.minutes[-1][0] < minute:
+            self.minutes.append([minute, 0, 0])
+            while self.minutes[0][0] <= minute - client_window_minutes:
+                self.minutes.popleft()
+        bucket = self.minutes[-1]
+        bucket[1] += 1
+        if status >= 400:
+            bucket[2] += 1
+
+    def window(self, since):
+        """Запросы и ошибки в минутах после since"""
+        count = errors = 0
+        for minute, n, e in reversed(self.minutes):
+            if minute <= since:
+                break
+            count += n
+            errors += e
+        return count, errors
+
+class ClientTracker:
+    """Скользящие счётчики по IP с вытеснением давно не появлявшихся (LRU)"""
+
+    def __init__(self):
+        self.ips = OrderedDict()   # IP -> ClientStats, недавно активные справа
+        self.latest = 0
+
+    def add(self, parsed):
+        t, ip = parsed['sort_time'], parsed['ip']
+        stats = self.ips.get(ip)
+        if stats is None:
+            stats = self.ips[ip] = ClientStats(t)
+            if len(self.ips) > client_max_ips:
+                self.ips.popitem(last=False)
+        else:
+            self.ips.move_to_end(ip)
+        stats.add(t, parsed['status'])
+        if t >= (self.latest + 1) * 60:
+            self.latest = int(t // 60)
+
+def clients_stats(selected, minutes=5, sort='count', limit=50):
+    """Самые активные IP за последние minutes минут по источникам
+
+    IP в трекере упорядочены по последней активности, поэтому обход идёт
+    с недавних и останавливается на первом IP, не появлявшемся в окне.
+    """
+    rows = {}
+    for src in selected:
+        with src.lock:
+            since = src.clients.latest - minutes
+            for ip in reversed(src.clients.ips):
+                stats = src.clients.ips[ip]
+                if stats.last_seen // 60 <= since:
+                    break
+                count, errors = stats.window(since)
+                row = rows.get(ip)
+                if row is None:
+                    rows[ip] = [count, errors, stats.total, stats.first_seen, stats.last_seen]
+                else:
+                    row[0] += count
+                    row[1] += errors
+                    row[2] += stats.total
+                    row[3] = min(row[3], stats.first_seen)
+                    row[4] = max(row[4], stats.last_seen)
+    column = CLIENT_SORTS[sort]
+    top = heapq.nlargest(limit, rows.items(), key=lambda item: item[1][column])
+    return [{'ip': ip, 'count': count, 'rate': round(count / minutes, 2), 'errors': errors,
+             'total': total, 'first_seen': first_seen, 'last_seen': last_seen}
+            for ip, (count, errors, total, first_seen, last_seen) in top]
+
+def client_detail(selected, ip):
+    """Карточка IP: запросы по минутам, первое/последнее появление, классы статусов"""
+    series = {}
+    classes = [0] * 6
+    found = []
+    for src in selected:
+        with src.lock:
+            stats = src.clients.ips.get(ip)
+            if stats is None:
+                continue
+            found.append(stats.first_seen)
+            found.append(stats.last_seen)
+            for i, n in enumerate(stats.classes):
+                classes[i] += n
+            for minute, n, e in stats.minutes:
+                point = series.setdefault(minute * 60, [0, 0])
+                point[0] += n
+                point[1] += e
+    if not found:
+        return None
+    return {
+        'ip': ip,
+        'first_seen': min(found),
+        'last_seen': max(found),
+        'total': sum(classes),
+        'statuses': {f'{i}xx': n for i, n in enumerate(classes) if n},
+        'series': [{'time': t, 'count': series.get(t, (0, 0))[0], 'errors': series.get(t, (0, 0))[1]}
+                   for t in range(min(series), max(series) + 60, 60)],
+    }
+
+class QuantileSketch:
+    """DDSketch: квантили с относительной точностью в логарифмических корзинах
+
+    Сливается простым сложением корзин, поэтому квантиль за любой
+    интервал собирается из готовых корзин без повторного чтения лога.
+    """
+
+    gamma = (1 + latency_accuracy) / (1 - latency_accuracy)
+    log_gamma = math.log(gamma)
+    min_value = 1e-4   # Всё быстрее 0.1 мс считаем нулём
+
+    def __init__(self):
+        self.bins = Counter()
+        self.zeros = 0
+        self.count = 0
+
+    def add(self, value):
+        self.count += 1
+        if value < self.min_value:
+            self.zeros += 1
+        else:
+            self.bins[math.ceil(math.log(value) / self.log_gamma)] += 1
+
+    def merge(self, other):
+        self.bins.update(other.bins)
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+    def summary(self):
+        return {'p50': self.quantile(0.5), 'p95': self.quantile(0.95), 'p99': self.quantile(0.99)}
+
+def normalize_route(url):
+    """URL -> маршрут: без query, числовые/hex/uuid сегменты заменены на :id"""
+    return ROUTE_ID_RE.sub('/:id', url.split('?', 1)[0]) or '/'
+
+class LatencyIndex:
+    """Скетчи латентности по маршрутам в минутных корзинах со свёрткой в часовые"""
+
+    def __init__(self):
+        self.minutes = {}   # минута -> {маршрут: {поле: QuantileSketch}}
+        self.hours = {}     # час -> то же самое
+        self.latest = 0
+
+    def add(self, parsed):
+        if parsed.get('request_time') is None and parsed.get('upstream_time') is None:
+            return
+        minute = int(parsed['sort_time'] // 60)
+        if minute > self.latest:
+            self.latest = minute
+            self.roll_up()
+        if minute > self.latest - latency_minute_buckets:
+            bucket = self.minutes.setdefault(minute, {})
+        else:
+            bucket = self.hours.setdefault(minute // 60, {})
+        route = normalize_route(parsed['url'])
+        if route not in bucket and len(bucket) >= latency_max_routes:
+            route = '(other)'
+        sketches = bucket.get(route)
+        if sketches is None:
+            sketches = bucket[route] = {field: QuantileSketch() for field in LATENCY_FIELDS}
+        for field in LATENCY_FIELDS:
+            if parsed.get(field) is not None:
+                sketches[field].add(parsed[field])
+
+    def roll_up(self):
+        """Сливает устаревшие минутные корзины в часовые и чистит старые часы"""
+        for minute in [m for m in self.minutes if m <= self.latest - latency_minute_buckets]:
+            hour = self.hours.setdefault(minute // 60, {})
+            for route, sketches in self.minutes.pop(minute).items():
+                if route not in hour and len(hour) >= latency_max_routes:
+                    route = '(other)'
+                target = hour.setdefault(route, {field: QuantileSketch() for field in LATENCY_FIELDS})
+                for field in LATENCY_FIELDS:
+                    target[field].merge(sketches[field])
+        for hour in [h for h in self.hours if h <= self.latest // 60 - latency_hour_buckets]:
+            del self.hours[hour]
+
+    def buckets(self, start=None, end=None):
+        """(начало корзины в секундах, корзина) для корзин, пересекающих интервал"""
+        for size, buckets in ((3600, self.hours), (60, self.minutes)):
+            for key, bucket in buckets.items():
+                begin = key * size
+                if (start is None or begin + size > start) and (end is None or begin <= end):
+                    yield begin, bucket
+
+def latency_stats(selected, start=None, end=None, route=None, step=60, limit=20):
+    """Квантили по маршрутам и ряд квантилей во времени за интервал"""
+    routes = {}
+    series = {}
+    for src in selected:
+        with src.lock:
+            for begin, bucket in src.latency.buckets(start, end):
+                point = series.setdefault(begin - begin % step, QuantileSketch())
+                for name, sketches in bucket.items():
+                    merged = routes.setdefault(name, {field: QuantileSketch() for field in LATENCY_FIELDS})
+                    for field in LATENCY_FIELDS:
+                        merged[field].merge(sketches[field])
+                    if route is None or name == route:
+                        point.merge(sketches['request_time'])
+    ranked = sorted(routes.items(), key=lambda item: -item[1]['request_time'].count)[:limit]
+    return {
+        'routes': [dict({'route': name, 'count': sketches['request_time'].count},
+                        **{field: sketches[field].summary() for field in LATENCY_FIELDS})
+                   for name, sketches in ranked],
+        'series': [dict({'time': begin, 'count': sketch.count}, **sketch.summary())
+                   for begin, sketch in sorted(series.items()) if sketch.count],
+    }
+
+def top_values(selected, field, k=10, minutes=15):
+    """Top-K значений поля по источникам за последние minutes минут"""
+    counts, errors = Counter(), Counter()
+    for src in selected:
+        with src.lock:
+            src.top.merge_into(field, minutes, counts, errors)
+    return [{'value': value, 'count': count, 'error': errors[value]}
+            for value, count in counts.most_common(k)]
+
+class EWMADetector:
+    """Экспоненциально сглаженные среднее и дисперсия одного ряда"""
+    __slots__ = ('mean', 'var', 'samples')
+
+    def __init__(self):
+        self.mean = 0.0
+        self.var = 0.0
+        self.samples = 0
+
+    def update(self, value, scale=1.0):
+        """Добавляет точку и возвращает её отклонение от прежней базы в сигмах
+
+        scale - во сколько раз вырос общий поток: доля ряда, выросшего вместе
+        со всем трафиком, всплеском не считается.
+        """
+        score = 0.0
+        if self.samples >= alert_warmup:
+            expected = self.mean * scale
+            # Дисперсия не ниже пуассоновской: на редких событиях ±1 - не всплеск
+            score = (value - expected) / math.sqrt(max(self.var * scale * scale, expected, 1.0))
+        if self.samples:
+            diff = value - self.mean
+            self.mean += alert_alpha * diff
+            self.var = (1 - alert_alpha) * (self.var + alert_alpha * diff * diff)
+        else:
+            self.mean = value
+        self.samples += 1
+        return score
+
+class AnomalyMonitor:
+    """Детекторы всплесков одного источника
+
+    На строку - четыре инкремента счётчиков текущей минуты. Когда время
+    строк (или часы тейлера, если строк нет) переходит в следующую минуту,
+    закрытая минута сворачивается в ряды
+    (запросы, классы статусов, максимум с одного IP, маршруты) и прогоняется
+    через EWMA-детекторы. Ряд, уже сработавший в прошлой минуте, повторно не
+    сообщается, пока не вернётся к норме.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.minute = None
+        self.requests = 0
+        self.classes = [0] * 6    # класс статуса (1xx..5xx) -> запросов в минуте
+        self.urls = Counter()     # URL -> запросов в текущей минуте
+        self.ips = Counter()      # IP -> запросов в текущей минуте
+        self.detectors = {}       # ряд -> EWMADetector
+        self.firing = set()
+
+    def add(self, parsed):
+        """Учитывает строку; возвращает алерты минут, закрытых этой строкой"""
+        minute = int(parsed['sort_time'] // 60)
+        found = []
+        if self.minute is None:
+            self.minute = minute
+        else:
+            found = self.advance(minute)
+        self.requests += 1
+        self.classes[min(parsed['status'] // 100, 5)] += 1
+        self.urls[parsed['url']] += 1
+        self.ips[parsed['ip']] += 1
+        return found
+
+    def advance(self, minute):
+        """Закрывает минуты до minute (не больше alert_max_gap пустых подряд)"""
+        found = []
+        if minute > self.minute:
+            for closed in range(max(self.minute, minute - alert_max_gap), minute):
+                found += self.close(closed)
+            self.minute = minute
+        return found
+
+    def tick(self, now):
+        """Закрывает минуты, истёкшие по часам: замолчавший лог тоже даёт провал"""
+        if self.minute is None:
+            return []
+        return self.advance(int((now - alert_close_delay) // 60))
+
+    def series(self):
+        """Значения рядов закрытой минуты и подписи к ним"""
+        values = {'requests': self.requests}
+        for status_class in range(2, 6):
+            values[f'{status_class}xx'] = self.classes[status_class]
+        details = {}
+        values['ip'] = 0
+        if self.ips:
+            details['ip'], values['ip'] = self.ips.most_common(1)[0]
+        routes = Counter()
+        for url, count in self.urls.items():
+            routes['route ' + normalize_route(url)] += count
+        for key in [key for key in self.detectors if key.startswith('route ')]:
+            if key in routes:
+                values[key] = routes[key]
+            elif self.detectors[key].samples >= alert_warmup and self.detectors[key].mean < 0.5:
+                del self.detectors[key]  # Остывший маршрут освобождает место
+            else:
+                values[key] = 0
+        free = alert_max_routes - (len(values) - 6)
+        for key, count in routes.most_common(max(free, 0)):
+            values.setdefault(key, count)
+        return values, details
+
+    def close(self, minute):
+        values, details = self.series()
+        self.requests = 0
+        self.classes = [0] * 6
+        self.urls.clear()
+        self.ips.clear()
+        requests = self.detectors.get('requests')
+        scale = 1.0
+        if requests is not None and requests.mean >= 1:
+            scale = max(values['requests'] / requests.mean, 1.0)
+        found = []
+        for key, value in values.items():
+            detector = self.detectors.get(key)
+            if detector is None:
+                detector = self.detectors[key] = EWMADetector()
+            baseline = detector.mean
+            score = detector.update(value, 1.0 if key == 'requests' else scale)
+            spike = score >= alert_threshold and value >= alert_min_count
+            # Провал ожидаем только в общем числе запросов (лог замолчал)
+            drop = key == 'requests' and score <= -alert_threshold and baseline >= alert_min_count
+            if not (spike or drop):
+                self.firing.discard(key)
+            elif key not in self.firing:
+                self.firing.add(key)
+                found.append({'time': minute * 60, 'source': self.name, 'series': key,
+                              'kind': 'spike' if spike else 'drop', 'value': value,
+                              'baseline': round(baseline, 1), 'score': round(score, 1),
+                              'detail': details.get(key, ''),
+                              'share': round(value / values['requests'], 3) if values['requests'] else 0})
+        return found
+
+def publish_alerts(found, subscribers=()):
+    """Кладёт алерты в общий журнал и в очереди подписчиков SSE"""
+    global alert_ids
+    for alert in found:
+        alert_ids += 1
+        alert['id'] = alert_ids
+        alerts.append(alert)
+        print(f"🚨 {format_alert(alert)}")
+        for q in subscribers:
+            try:
+                q.put_nowait(('alert', alert))
+            except queue.Full:
+                pass
+
+def format_alert(alert):
+    when = datetime.fromtimestamp(alert['time']).strftime('%d.%m.%Y %H:%M')
+    detail = f" ({alert['detail']})" if alert['detail'] else ''
+    return (f"{when} {alert['source']}: {alert['series']}{detail} {alert['kind']} "
+            f"{alert['value']} при базе {alert['baseline']} ({alert['score']:+.1f}σ)")
+
+def replay_alerts(paths):
+    """Прогоняет файлы через детекторы как живой поток и печатает алерты (JSON Lines)"""
+    for name, path in paths.items():
+        monitor = AnomalyMonitor(name)
+        with open(path, 'rb') as f:
+            for raw in f:
+                parsed = parse_log_line(raw.decode('utf-8', errors='replace'))
+                if parsed:
+                    for alert in monitor.add(parsed):
+                        print(json.dumps(alert, ensure_ascii=False), flush=True)
+
+class WireEncoder:
+    """Компактный формат: словари строк и строки-массивы из целых чисел
+
+    Сообщение: {"dict": {поле: [новые значения]}, "rows": [[...], ...]},
+    порядок колонок - WIRE_FIELDS. Строковые поля передаются номером в
+    словаре соединения (или самой строкой, если словарь переполнен), время -
+    целыми секундами дельтой к предыдущей строке сообщения, времена ответа -
+    в миллисекундах, id - дельтой к предыдущему id сообщения. Производные
+    поля (color, timestamp) не передаются, raw/referer/agent - через /detail.
+    """
+
+    def __init__(self):
+        self.ids = {field: {} for field in WIRE_DICT_FIELDS}
+
+    def code(self, field, value, new):
+        ids = self.ids[field]
+        code = ids.get(value)
+        if code is None:
+            if len(ids) >= wire_dict_limit:
+                return value
+            code = ids[value] = len(ids)
+            new[field].append(value)
+        return code
+
+    def encode(self, entries):
+        new = {field: [] for field in WIRE_DICT_FIELDS}
+        rows = []
+        prev = prev_id = 0
+        for e in entries:
+            t = int(e['sort_time'])
+            entry_id = e.get('id')
+            rows.append([
+                t - prev,
+                self.code('ip', e['ip'], new),
+                self.code('method', e['method'], new),
+                self.code('url', e['url'], new),
+                e['status'],
+                int(e['size']),
+                None if e.get('request_time') is None else round(e['request_time'] * 1000),
+                None if e.get('upstream_time') is None else round(e['upstream_time'] * 1000),
+                self.code('source', e.get('source', ''), new),
+                None if entry_id is None else entry_id - prev_id,
+                self.code('ua', e.get('ua', ''), new),
+            ])
+            prev = t
+            if entry_id is not None:
+                prev_id = entry_id
+        return {'dict': {field: values for field, values in new.items() if values}, 'rows': rows}
+
+    def dumps(self, entries):
+        return json.dumps(self.encode(entries), separators=(',', ':'))
+
+def bench_wire():
+    """Сравнивает JSON и компактный формат на загруженных источниках"""
+    for src in sources.values():
+        entries = src.snapshot()
+        if not entries:
+            continue
+        n = len(entries)
+        raw_bytes = sum(len(e['raw'].encode()) for e in src.details([e['id'] for e in entries[:detail_max_ids]]))
+        raw_bytes = raw_bytes * n / min(n, detail_max_ids)
+        started = time.perf_counter()
+        json_stream = sum(len(f'data: {json.dumps(e)}\n\n'.encode()) for e in entries)
+        json_time = time.perf_counter() - started
+        encoder = WireEncoder()
+        started = time.perf_counter()
+        compact_stream = sum(len(f'data: {encoder.dumps([e])}\n\n'.encode()) for e in entries)
+        compact_time = time.perf_counter() - started
+        json_bulk = len(json.dumps(entries).encode())
+        compact_bulk = len(WireEncoder().dumps(entries).encode())
+        print(f'📦 {src.name}: {n} записей, исходная строка {raw_bytes / n:.0f} Б')
+        print(f'   /stream   json {json_stream / n:7.1f} Б/событие ({json_time / n * 1e6:.1f} мкс)'
+              f'   compact {compact_stream / n:7.1f} Б/событие ({compact_time / n * 1e6:.1f} мкс)')
+        print(f'   /full-log json {json_bulk / n:7.1f} Б/запись'
+              f'   compact {compact_bulk / n:7.1f} Б/запись ({json_bulk / compact_bulk:.1f}x)')
+    print('⏱️ Время декодирования в браузере пишется в консоль страницы (?wire=json|compact)')
+
+def resolve_sources(name):
+    """Источники по имени из запроса; '*' - все сразу"""
+    if name == ALL_SOURCES:
+        return list(sources.values())
+    if name in sources:
+        return [sources[name]]
+    return list(islice(sources.values(), 1))
+
+def merged_entries(selected, limit=None):
+    """K-way слияние индексов нескольких источников по времени (новые сверху)"""
+    limit = limit or max_history
+    if len(selected) == 1:
+        return selected[0].snapshot()[:limit]
+    merged = heapq.merge(*(src.snapshot() for src in selected),
+                         key=lambda e: e['sort_time'], reverse=True)
+    return list(islice(merged, limit))
+
+def tail_loop():
+    """Общий цикл опроса: один поток на все источники вместо tail -f на клиента"""
+    while True:
+        for src in list(sources.values()):
+            try:
+                src.poll()
+            except Exception as e:
+                print(f"Ошибка чтения {src.path}: {e}")
+        reorder_buffer.flush()
+        now = time.time()
+        for src in list(sources.values()):
+            src.tick(now)
+        if store is not None:
+            try:
+                store.flush([src for src in sources.values() if src.persist])
+            except Exception as e:
+                print(f"Ошибка записи в базу: {e}")
+        time.sleep(poll_interval)
+
+def parse_source_specs(specs, taken=()):
+    """Разбирает аргументы вида имя=путь или просто путь"""
+    result = {}
+    for spec in specs:
+        name, sep, path = spec.partition('=')
+        if not sep or '/' in name:
+            path = spec
+            parts = urlsplit(spec)
+            name = parts.netloc if parts.scheme else os.path.basename(spec).split('.')[0]
+            name = name or 'log'
+        base, n = name, 2
+        while name in result or name in taken or name == ALL_SOURCES:
+            name = f'{base}-{n}'
+            n += 1
+        result[name] = path
+    return result
+
 html_template = '''<!DOCTYPE html>
 <html>
 <head>
@@ -328,6 +2123,29 @@ html_template = '''<!DOCTYPE html>
             background: #1a1f2a;
         }}
         
+        .log-line[data-id] {{
+            cursor: pointer;
+        }}
+        
+        .log-detail {{
+            padding: 10px 20px 12px 170px;
+            background: #141821;
+            border-bottom: 1px solid #1a1f2a;
+            font-size: 12px;
+            color: #b8c0cc;
+        }}
+        
+        .log-detail pre {{
+            white-space: pre-wrap;
+            word-break: break-all;
+            margin: 0 0 8px;
+            color: #e6e6e6;
+        }}
+        
+        .log-detail span {{
+            margin-right: 20px;
+        }}
+        
         .status-badge {{
             padding: 2px 8px;
             border-radius: 4px;
@@ -428,18 +2246,166 @@ html_template = '''<!DOCTYPE html>
             align-items: center;
         }}
         
-        .total-entries {{
-            color: #7aa2f7;
+        .source-tag {{
+            color: #88909f;
+            font-size: 11px;
+            margin-right: 6px;
+        }}
+        
+        .panel {{
+            background: #0f1319;
+            border: 1px solid #2c313a;
+            border-radius: 8px;
+            padding: 15px;
+            margin-top: 20px;
+        }}
+        
+        .panel-title {{
+            display: flex;
+            justify-content: space-between;
+            align-items: center;
+            color: #a9b1d6;
             font-weight: bold;
+            margin-bottom: 10px;
         }}
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="header">
-            <h1>🔍 Nginx Live Log </h1>
+        
+        .top-grid {{
+            display: grid;
+            grid-template-columns: repeat(auto-fit, minmax(250px, 1fr));
+            gap: 15px;
+        }}
+        
+        .top-list {{
+            list-style: none;
+            margin: 0;
+            padding: 0;
+        }}
+        
+        .top-list li {{
+            display: flex;
+            justify-content: space-between;
+            gap: 10px;
+            padding: 3px 0;
+            border-bottom: 1px solid #1a1f2a;
+            cursor: pointer;
+        }}
+        
+        .top-list li:hover {{
+            color: #7aa2f7;
+        }}
+        
+        .top-value {{
+            overflow: hidden;
+            text-overflow: ellipsis;
+            white-space: nowrap;
+        }}
+        
+        .top-count {{
+            color: #7aa2f7;
+            font-weight: bold;
+        }}
+        
+        .latency-table {{
+            width: 100%;
+            border-collapse: collapse;
+        }}
+        
+        .latency-table th, .latency-table td {{
+            padding: 4px 8px;
+            border-bottom: 1px solid #1a1f2a;
+            text-align: right;
+        }}
+        
+        .latency-table th:first-child, .latency-table td:first-child {{
+            text-align: left;
+            word-break: break-all;
+        }}
+        
+        .latency-table th {{
+            color: #7aa2f7;
+            font-size: 11px;
+            text-transform: uppercase;
+        }}
+        
+        .clients-table th[data-sort], .clients-table tbody tr {{
+            cursor: pointer;
+        }}
+        
+        .clients-table th.active {{
+            color: #e6e6e6;
+        }}
+        
+        .clients-table tbody tr:hover, .clients-table tbody tr.selected {{
+            background: #1a1f2a;
+        }}
+        
+        .client-detail {{
+            margin-top: 10px;
+            padding: 10px;
+            background: #141821;
+            border-radius: 6px;
+            font-size: 12px;
+            color: #b8c0cc;
+        }}
+        
+        .client-detail span {{
+            margin-right: 20px;
+        }}
+        
+        .alert-list {{
+            list-style: none;
+            margin: 0;
+            padding: 0;
+            max-height: 150px;
+            overflow-y: auto;
+        }}
+        
+        .alert-list li {{
+            padding: 3px 0;
+            border-bottom: 1px solid #1a1f2a;
+            cursor: pointer;
+        }}
+        
+        .alert-list li:hover {{
+            color: #7aa2f7;
+        }}
+        
+        .alert-spike {{
+            color: #f7768e;
+            font-weight: bold;
+        }}
+        
+        .alert-drop {{
+            color: #e0af68;
+            font-weight: bold;
+        }}
+        
+        .timeline {{
+            width: 100%;
+            height: 90px;
+            cursor: crosshair;
+            user-select: none;
+        }}
+        
+        .timeline-axis {{
+            display: flex;
+            justify-content: space-between;
+            color: #565f89;
+            font-size: 11px;
+        }}
+        
+        .total-entries {{
+            color: #7aa2f7;
+            font-weight: bold;
+        }}
+    </style>
+</head>
+<body>
+    <div class="container">
+        <div class="header">
+            <h1>🔍 Nginx Live Log </h1>
             <div class="file-info">
-                <span>📁 {log_file}</span>
+                <span id="source-path">📁 {log_file}</span>
                 <span class="file-stats" id="total-file-entries">Загрузка...</span>
             </div>
             
@@ -463,6 +2429,13 @@ html_template = '''<!DOCTYPE html>
             </div>
             
             <div class="filters">
+                <div class="filter-group">
+                    <label>🗂️ Источник</label>
+                    <select id="filter-source">
+                        {source_options}
+                    </select>
+                </div>
+                
                 <div class="filter-group">
                     <label>🌐 Фильтр по IP</label>
                     <input type="text" id="filter-ip" placeholder="например: 192.168.1.1" autocomplete="off">
@@ -493,6 +2466,19 @@ html_template = '''<!DOCTYPE html>
                     </select>
                 </div>
                 
+                <div class="filter-group">
+                    <label>👥 Клиенты</label>
+                    <select id="filter-ua">
+                        <option value="">Все клиенты</option>
+                        <option value="human">Люди (без ботов и утилит)</option>
+                        <option value="browser">Браузеры</option>
+                        <option value="mobile">Мобильные</option>
+                        <option value="bot">Боты</option>
+                        <option value="tool">Утилиты (curl, скрипты)</option>
+                        <option value="other">Прочие</option>
+                    </select>
+                </div>
+                
                 <div class="filter-group">
                     <label>🔍 Поиск в URL</label>
                     <input type="text" id="filter-url" placeholder="текст в URL..." autocomplete="off">
@@ -533,6 +2519,9 @@ html_template = '''<!DOCTYPE html>
                 <button class="button" onclick="loadFullLog()">
                     📂 Загрузить весь лог
                 </button>
+                <button class="button" onclick="searchFile()" title="Подстрока из поля URL и статус - по всему файлу, а не только по загруженным записям">
+                    🔎 Искать во всём файле
+                </button>
                 <button class="button" onclick="clearFilters()">
                     🧹 Очистить фильтры
                 </button>
@@ -543,6 +2532,91 @@ html_template = '''<!DOCTYPE html>
                     💾 Экспорт CSV
                 </button>
             </div>
+            
+            <div class="panel" id="top-panel">
+                <div class="panel-title">
+                    <span>🔥 Топ за окно</span>
+                    <select id="top-window" style="width: 120px;">
+                        <option value="5">5 мин</option>
+                        <option value="15" selected>15 мин</option>
+                        <option value="60">1 час</option>
+                    </select>
+                </div>
+                <div class="top-grid">
+                    <div><div class="stat-label">🌐 IP</div><ul class="top-list" id="top-ip"></ul></div>
+                    <div><div class="stat-label">📌 URL</div><ul class="top-list" id="top-url"></ul></div>
+                    <div><div class="stat-label">↩️ Referer</div><ul class="top-list" id="top-referer"></ul></div>
+                    <div><div class="stat-label">🤖 User Agent</div><ul class="top-list" id="top-agent"></ul></div>
+                </div>
+            </div>
+            
+            <div class="panel" id="clients-panel">
+                <div class="panel-title">
+                    <span>👥 Клиенты по User-Agent</span>
+                    <span class="stat-label" title="Клик по классу - фильтр по нему">по отфильтрованным записям</span>
+                </div>
+                <div class="top-grid">
+                    <div><div class="stat-label">Классы</div><ul class="top-list" id="client-classes"></ul></div>
+                    <div><div class="stat-label">Семейства</div><ul class="top-list" id="client-families"></ul></div>
+                </div>
+            </div>
+            
+            <div class="panel" id="hot-clients-panel">
+                <div class="panel-title">
+                    <span>🕵️ Самые активные IP</span>
+                    <select id="clients-window" style="width: 120px;">
+                        <option value="1">1 мин</option>
+                        <option value="5" selected>5 мин</option>
+                        <option value="15">15 мин</option>
+                        <option value="30">30 мин</option>
+                    </select>
+                </div>
+                <table class="latency-table clients-table">
+                    <thead>
+                        <tr>
+                            <th>IP</th><th data-sort="count">Запросов</th><th data-sort="count">В мин</th>
+                            <th data-sort="errors">Ошибок</th><th data-sort="total">Всего</th>
+                            <th data-sort="first_seen">Впервые</th><th data-sort="last_seen">Последний</th>
+                        </tr>
+                    </thead>
+                    <tbody id="clients-rows"><tr><td colspan="7">-</td></tr></tbody>
+                </table>
+                <div id="client-detail" class="client-detail" style="display: none;"></div>
+            </div>
+            
+            <div class="panel" id="alerts-panel">
+                <div class="panel-title">
+                    <span>🚨 Аномалии</span>
+                    <span class="stat-label" title="Клик по алерту - фильтр на его минуту">базовая линия EWMA, новые сверху</span>
+                </div>
+                <ul class="alert-list" id="alert-list"><li>-</li></ul>
+            </div>
+            
+            <div class="panel" id="timeline-panel">
+                <div class="panel-title">
+                    <span>📊 Запросы во времени (<span style="color: #e0af68;">4xx</span> / <span style="color: #f7768e;">5xx</span>)</span>
+                    <span class="stat-label" id="timeline-step" title="Выделите мышью интервал для приближения, двойной клик - сброс"></span>
+                </div>
+                <svg id="timeline" class="timeline" preserveAspectRatio="none"></svg>
+                <div class="timeline-axis"><span id="timeline-from"></span><span id="timeline-to"></span></div>
+            </div>
+            
+            <div class="panel" id="latency-panel">
+                <div class="panel-title">
+                    <span>⏱️ Латентность (request / upstream), сек</span>
+                    <svg id="latency-spark" width="300" height="40" title="p95 во времени"></svg>
+                </div>
+                <table class="latency-table">
+                    <thead>
+                        <tr>
+                            <th>Маршрут</th><th>Запросов</th>
+                            <th>p50</th><th>p95</th><th>p99</th>
+                            <th>up p50</th><th>up p95</th><th>up p99</th>
+                        </tr>
+                    </thead>
+                    <tbody id="latency-rows"><tr><td colspan="8">-</td></tr></tbody>
+                </table>
+            </div>
         </div>
         
         <div class="log-container">
@@ -589,8 +2663,6 @@ html_template = '''<!DOCTYPE html>
     </div>
 
     <script>
-        let logs = [];
-        let filteredLogs = [];
         let isPaused = false;
         let sortField = 'sort_time';
         let sortDirection = 'desc';
@@ -602,68 +2674,93 @@ html_template = '''<!DOCTYPE html>
         // Временные фильтры
         let startTimeFilter = null;
         let endTimeFilter = null;
+        let timelineData = null;
+        let alertItems = [];
+        let brush = null;
         let activePreset = null;
         
+        // Источник (имя лога или '*' для всех)
+        let currentSource = '';
+        let evtSource = null;
+        
+        // Последний ответ воркера: видимая страница и статистика
+        let lastResult = {{rows: [], stats: null, page: 1, from: 0, to: 0, filtered: 0, total: 0}};
+        let queryId = 0;
+        
         const logContainer = document.getElementById('log-entries');
         
+        // Формат передачи: compact (по умолчанию) или json, меняется через ?wire=
+        const WIRE_FORMAT = new URLSearchParams(location.search).get('wire') || 'compact';
+        const MAX_CLIENT_ENTRIES = 200000;
+        
+        // Фильтрация, сортировка и статистика идут в воркере, здесь - только отрисовка
+        const worker = new Worker('/worker.js');
+        worker.postMessage({{type: 'init', maxEntries: MAX_CLIENT_ENTRIES, wireFormat: WIRE_FORMAT}});
+        worker.onmessage = function(e) {{
+            const msg = e.data;
+            if (msg.type === 'result') {{
+                if (msg.id !== queryId) return;  // Устаревший ответ
+                lastResult = msg;
+                currentPage = msg.page;
+                updateStats();
+                renderLogs();
+            }} else if (msg.type === 'loaded') {{
+                console.info(`📦 ${{msg.label}} (${{WIRE_FORMAT}}): ${{msg.total}} записей, ` +
+                    `${{(msg.bytes / Math.max(msg.total, 1)).toFixed(1)}} Б/запись, ` +
+                    `загрузка ${{msg.fetchMs.toFixed(0)}} мс, разбор ${{msg.decodeMs.toFixed(1)}} мс (в воркере)`);
+                document.getElementById('total-file-count').textContent = msg.total;
+                document.getElementById('total-file-entries').innerHTML = msg.label === '/search'
+                    ? `🔎 Найдено в файле: ${{msg.total}}`
+                    : `📊 Всего записей: ${{msg.total}}`;
+            }} else if (msg.type === 'error') {{
+                logContainer.innerHTML = `<div style="padding: 40px; text-align: center; color: #ff6b6b;">❌ Ошибка загрузки: ${{escapeHtml(msg.label)}}</div>`;
+                console.error('Error loading log:', msg.message);
+            }} else if (msg.type === 'export') {{
+                finishExport(msg);
+            }}
+        }};
+        
         function formatTime(timestamp) {{
             return timestamp || '';
         }}
         
+        function statusStyle(status) {{
+            if (status >= 500) return 'color: #ff6b6b; background: #2c1a1a; font-weight: bold;';
+            if (status >= 400) return 'color: #ffd93d; background: #2c261a; font-weight: bold;';
+            if (status >= 300) return 'color: #6bafff; background: #1a1f2c;';
+            return 'color: #69db7e; background: #1a2c1a;';
+        }}
+        
+        function escapeHtml(text) {{
+            return String(text).replace(/[&<>"']/g, c => ({{'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}})[c]);
+        }}
+        
+        // Отправляет воркеру текущие фильтры, сортировку и страницу
+        function requestPage(page) {{
+            worker.postMessage({{type: 'query', query: {{
+                id: ++queryId,
+                ip: document.getElementById('filter-ip').value,
+                status: document.getElementById('filter-status').value,
+                method: document.getElementById('filter-method').value,
+                url: document.getElementById('filter-url').value,
+                ua: document.getElementById('filter-ua').value,
+                start: startTimeFilter,
+                end: endTimeFilter,
+                sortField,
+                sortDirection,
+                page,
+                pageSize
+            }}}});
+        }}
+        
         function applyFilters() {{
-            const ipFilter = document.getElementById('filter-ip').value.toLowerCase();
-            const statusFilter = document.getElementById('filter-status').value;
-            const methodFilter = document.getElementById('filter-method').value;
-            const urlFilter = document.getElementById('filter-url').value.toLowerCase();
-            
-            filteredLogs = logs.filter(log => {{
-                if (!log) return false;
-                
-                // IP фильтр
-                if (ipFilter && !log.ip.toLowerCase().includes(ipFilter)) return false;
-                
-                // Статус фильтр
-                if (statusFilter) {{
-                    if (statusFilter === '4xx' && (log.status < 400 || log.status >= 500)) return false;
-                    else if (statusFilter === '5xx' && (log.status < 500 || log.status >= 600)) return false;
-                    else if (!isNaN(statusFilter) && log.status != parseInt(statusFilter)) return false;
-                }}
-                
-                // Метод фильтр
-                if (methodFilter && log.method !== methodFilter) return false;
-                
-                // URL фильтр
-                if (urlFilter && !log.url.toLowerCase().includes(urlFilter)) return false;
-                
-                // Временной фильтр
-                if (startTimeFilter && log.sort_time < startTimeFilter) return false;
-                if (endTimeFilter && log.sort_time > endTimeFilter) return false;
-                
-                return true;
-            }});
-            
-            sortLogs();
-            updateStats();
-            currentPage = 1;
-            renderLogs();
+            requestPage(1);
         }}
         
-        function sortLogs() {{
-            filteredLogs.sort((a, b) => {{
-                let valA = a[sortField];
-                let valB = b[sortField];
-                
-                if (sortField === 'status' || sortField === 'size') {{
-                    valA = parseInt(valA) || 0;
-                    valB = parseInt(valB) || 0;
-                }}
-                
-                if (sortDirection === 'asc') {{
-                    return valA > valB ? 1 : -1;
-                }} else {{
-                    return valA < valB ? 1 : -1;
-                }}
-            }});
+        function applyTimeFilters() {{
+            applyFilters();
+            refreshLatency();
+            refreshTimeline();
         }}
         
         function sortBy(field) {{
@@ -673,14 +2770,13 @@ html_template = '''<!DOCTYPE html>
                 sortField = field;
                 sortDirection = 'desc';
             }}
-            sortLogs();
-            renderLogs();
+            requestPage(currentPage);
         }}
         
         function renderLogs() {{
             if (!logContainer) return;
             
-            if (filteredLogs.length === 0) {{
+            if (lastResult.filtered === 0) {{
                 logContainer.innerHTML = '<div style="padding: 40px; text-align: center; color: #88909f;">🔍 Нет записей, соответствующих фильтрам</div>';
                 document.getElementById('showing-entries').innerHTML = 'Показано 0-0 из 0';
                 document.getElementById('page-info').innerHTML = '0/0';
@@ -691,31 +2787,29 @@ html_template = '''<!DOCTYPE html>
                 return;
             }}
             
-            const start = (currentPage - 1) * pageSize;
-            const end = Math.min(start + pageSize, filteredLogs.length);
-            const pageLogs = filteredLogs.slice(start, end);
-            
-            const html = pageLogs.map(log => `
-                <div class="log-line ${{log.status >= 500 ? 'error-500' : log.status >= 400 ? 'error-404' : ''}}">
+            const html = lastResult.rows.map(log => `
+                <div class="log-line ${{log.status >= 500 ? 'error-500' : log.status >= 400 ? 'error-404' : ''}}"
+                     ${{log.id !== null ? `data-id="${{log.id}}" data-source="${{escapeHtml(log.source)}}" onclick="toggleDetail(this)"` : ''}}>
                     <span style="color: #88909f;">${{formatTime(log.timestamp)}}</span>
-                    <span class="ip-address">${{log.ip || ''}}</span>
-                    <span><span class="method-badge">${{log.method || ''}}</span></span>
-                    <span style="color: #e6e6e6; word-break: break-all;">${{log.url || ''}}</span>
-                    <span><span class="status-badge" style="${{log.color || ''}}">${{log.status || ''}}</span></span>
+                    <span class="ip-address">${{escapeHtml(log.ip || '')}}</span>
+                    <span><span class="method-badge">${{escapeHtml(log.method || '')}}</span></span>
+                    <span style="color: #e6e6e6; word-break: break-all;">${{currentSource === '*' ? `<span class="source-tag">[${{escapeHtml(log.source)}}]</span>` : ''}}${{escapeHtml(log.url || '')}}</span>
+                    <span><span class="status-badge" style="${{statusStyle(log.status)}}">${{log.status || ''}}</span></span>
                     <span style="color: #88909f; text-align: right;">${{log.size || '0'}} B</span>
                 </div>
+                ${{openDetail && openDetail.key === `${{log.source}} ${{log.id}}` ? `<div class="log-detail">${{openDetail.html}}</div>` : ''}}
             `).join('');
             
             logContainer.innerHTML = html;
             
             // Обновляем информацию о пагинации
-            const totalPages = Math.ceil(filteredLogs.length / pageSize);
+            const totalPages = Math.ceil(lastResult.filtered / pageSize);
             document.getElementById('showing-entries').innerHTML = 
-                `Показано ${{start+1}}-${{end}} из ${{filteredLogs.length}}`;
+                `Показано ${{lastResult.from + 1}}-${{lastResult.to}} из ${{lastResult.filtered}}`;
             document.getElementById('page-info').innerHTML = 
                 `${{currentPage}}/${{totalPages}}`;
             document.getElementById('filtered-percent').innerHTML = 
-                `(${{((filteredLogs.length / logs.length) * 100).toFixed(1)}}% от общего)`;
+                `(${{((lastResult.filtered / lastResult.total) * 100).toFixed(1)}}% от общего)`;
             
             document.getElementById('prev-btn').disabled = currentPage === 1;
             document.getElementById('next-btn').disabled = currentPage >= totalPages;
@@ -725,72 +2819,139 @@ html_template = '''<!DOCTYPE html>
             document.getElementById('update-time').textContent = new Date().toLocaleTimeString();
         }}
         
-        function firstPage() {{
-            currentPage = 1;
+        // Детали строки (raw, referer, agent) запрашиваются по клику
+        let openDetail = null;
+        
+        async function toggleDetail(row) {{
+            const source = row.dataset.source, id = row.dataset.id;
+            const key = `${{source}} ${{id}}`;
+            if (openDetail && openDetail.key === key) {{
+                openDetail = null;
+                renderLogs();
+                return;
+            }}
+            openDetail = {{key, html: '⏳ Загрузка...'}};
             renderLogs();
+            let html;
+            try {{
+                const response = await fetch(`/detail?source=${{encodeURIComponent(source)}}&ids=${{id}}`);
+                const [d] = await response.json();
+                const ms = t => t === null || t === undefined ? '-' : `${{Math.round(t * 1000)}} мс`;
+                html = d ? `<pre>${{escapeHtml(d.raw)}}</pre>
+                    <span>↩️ ${{escapeHtml(d.referer)}}</span>
+                    <span>🤖 ${{escapeHtml(d.agent)}}</span>
+                    <span>⏱️ ${{ms(d.request_time)}} / upstream ${{ms(d.upstream_time)}}</span>`
+                    : '⚠️ Строка недоступна (файл ротирован или узел не отвечает)';
+            }} catch (error) {{
+                html = '❌ Ошибка загрузки деталей';
+            }}
+            if (openDetail && openDetail.key === key) {{
+                openDetail.html = html;
+                renderLogs();
+            }}
+        }}
+        
+        function firstPage() {{
+            requestPage(1);
         }}
         
         function prevPage() {{
             if (currentPage > 1) {{
-                currentPage--;
-                renderLogs();
+                requestPage(currentPage - 1);
             }}
         }}
         
         function nextPage() {{
-            if (currentPage < Math.ceil(filteredLogs.length / pageSize)) {{
-                currentPage++;
-                renderLogs();
+            if (currentPage < Math.ceil(lastResult.filtered / pageSize)) {{
+                requestPage(currentPage + 1);
             }}
         }}
         
         function lastPage() {{
-            currentPage = Math.ceil(filteredLogs.length / pageSize);
-            renderLogs();
+            requestPage(Math.ceil(lastResult.filtered / pageSize));
         }}
         
         function updateStats() {{
-            document.getElementById('total-count').textContent = filteredLogs.length;
-            
-            const errors = filteredLogs.filter(l => l.status >= 400).length;
-            document.getElementById('error-count').textContent = errors;
-            
-            const uniqueIPs = new Set(filteredLogs.map(l => l.ip)).size;
-            document.getElementById('unique-ips').textContent = uniqueIPs;
+            const stats = lastResult.stats;
+            if (!stats) return;
+            document.getElementById('total-count').textContent = stats.count;
+            document.getElementById('error-count').textContent = stats.errors;
+            document.getElementById('unique-ips').textContent = stats.uniqueIPs;
             
             // Временной диапазон
-            if (filteredLogs.length > 0) {{
-                const oldest = new Date(Math.min(...filteredLogs.map(l => l.sort_time)) * 1000);
-                const newest = new Date(Math.max(...filteredLogs.map(l => l.sort_time)) * 1000);
+            if (stats.count > 0) {{
+                const oldest = new Date(stats.oldest * 1000);
+                const newest = new Date(stats.newest * 1000);
                 document.getElementById('time-range-stats').innerHTML = 
                     `${{oldest.toLocaleDateString()}} ${{oldest.toLocaleTimeString()}}<br>→ ${{newest.toLocaleDateString()}} ${{newest.toLocaleTimeString()}}`;
             }} else {{
                 document.getElementById('time-range-stats').textContent = '-';
             }}
+            renderClients(stats.clients);
+        }}
+        
+        const CLIENT_CLASSES = {{browser: '🌐 Браузеры', mobile: '📱 Мобильные', bot: '🤖 Боты', tool: '🛠️ Утилиты', other: '❔ Прочие'}};
+        
+        function renderClients(clients) {{
+            const total = Object.values(clients.classes).reduce((a, b) => a + b, 0) || 1;
+            const share = count => `${{count}} · ${{(count / total * 100).toFixed(1)}}%`;
+            document.getElementById('client-classes').innerHTML = Object.entries(clients.classes)
+                .sort((a, b) => b[1] - a[1])
+                .map(([cls, count]) => `
+                    <li data-class="${{escapeHtml(cls)}}">
+                        <span class="top-value">${{CLIENT_CLASSES[cls] || escapeHtml(cls)}}</span>
+                        <span class="top-count">${{share(count)}}</span>
+                    </li>
+                `).join('') || '<li>-</li>';
+            document.getElementById('client-families').innerHTML = clients.families.map(([label, count]) => `
+                <li data-class="${{escapeHtml(label.split('/')[0])}}" title="${{escapeHtml(label)}}">
+                    <span class="top-value">${{escapeHtml(label.split('/').slice(1).join('/'))}} <span class="source-tag">${{escapeHtml(label.split('/')[0])}}</span></span>
+                    <span class="top-count">${{share(count)}}</span>
+                </li>
+            `).join('') || '<li>-</li>';
+        }}
+        
+        function filterByClientClass(e) {{
+            const item = e.target.closest('li[data-class]');
+            if (!item) return;
+            document.getElementById('filter-ua').value = item.dataset.class;
+            applyFilters();
         }}
         
         function togglePause() {{
             isPaused = !isPaused;
+            worker.postMessage({{type: 'pause', paused: isPaused}});
             document.getElementById('pause-icon').textContent = isPaused ? '▶️' : '⏸️';
             document.getElementById('pause-text').textContent = isPaused ? 'Возобновить' : 'Пауза';
         }}
         
         function loadFullLog() {{
             logContainer.innerHTML = '<div style="padding: 40px; text-align: center; color: #88909f;">🔄 Загрузка лог-файла...</div>';
-            
-            fetch('/full-log')
-                .then(response => response.json())
-                .then(data => {{
-                    logs = data;
-                    document.getElementById('total-file-count').textContent = logs.length;
-                    document.getElementById('total-file-entries').innerHTML = 
-                        `📊 Всего записей: ${{logs.length}}`;
-                    applyFilters();
-                }})
-                .catch(error => {{
-                    logContainer.innerHTML = '<div style="padding: 40px; text-align: center; color: #ff6b6b;">❌ Ошибка загрузки лога</div>';
-                    console.error('Error loading log:', error);
-                }});
+            worker.postMessage({{type: 'load', label: '/full-log',
+                                url: `/full-log?source=${{encodeURIComponent(currentSource)}}&format=${{WIRE_FORMAT}}`}});
+            applyFilters();
+        }}
+        
+        // Поиск на сервере по всему файлу с текущими фильтрами (результат кэшируется)
+        function searchFile() {{
+            const params = new URLSearchParams({{
+                source: currentSource,
+                q: document.getElementById('filter-url').value,
+                status: document.getElementById('filter-status').value,
+                ip: document.getElementById('filter-ip').value,
+                method: document.getElementById('filter-method').value,
+                format: WIRE_FORMAT
+            }});
+            // Пресет передаём как "последние N минут" - так запросы дашборда попадают в кэш
+            if (activePreset) {{
+                params.set('minutes', activePreset);
+            }} else {{
+                if (startTimeFilter) params.set('start', startTimeFilter);
+                if (endTimeFilter) params.set('end', endTimeFilter);
+            }}
+            logContainer.innerHTML = '<div style="padding: 40px; text-align: center; color: #88909f;">🔎 Поиск по файлу...</div>';
+            worker.postMessage({{type: 'load', label: '/search', url: `/search?${{params}}`}});
+            applyFilters();
         }}
         
         function clearFilters() {{
@@ -798,6 +2959,7 @@ html_template = '''<!DOCTYPE html>
             document.getElementById('filter-status').value = '';
             document.getElementById('filter-method').value = '';
             document.getElementById('filter-url').value = '';
+            document.getElementById('filter-ua').value = '';
             
             // Сброс временных фильтров
             startTimeFilter = null;
@@ -808,22 +2970,25 @@ html_template = '''<!DOCTYPE html>
             }});
             document.getElementById('custom-time-picker').style.display = 'none';
             
-            applyFilters();
+            applyTimeFilters();
         }}
         
+        // Копирование и экспорт собираются в воркере, сюда приходит готовый буфер
         function copyVisible() {{
-            const text = filteredLogs.map(l => l.raw).join('\\n');
-            navigator.clipboard.writeText(text);
-            alert(`📋 Скопировано ${{filteredLogs.length}} строк`);
+            worker.postMessage({{type: 'export', kind: 'lines'}});
         }}
         
         function exportFiltered() {{
-            let csv = 'Timestamp,IP,Method,URL,Status,Size,Referer,User Agent\\n';
-            filteredLogs.forEach(log => {{
-                csv += `"${{log.timestamp}}","${{log.ip}}","${{log.method}}","${{log.url}}","${{log.status}}","${{log.size}}","${{log.referer}}","${{log.agent}}"\\n`;
-            }});
-            
-            const blob = new Blob([csv], {{ type: 'text/csv' }});
+            worker.postMessage({{type: 'export', kind: 'csv'}});
+        }}
+        
+        function finishExport(msg) {{
+            if (msg.kind === 'lines') {{
+                navigator.clipboard.writeText(new TextDecoder().decode(msg.buffer));
+                alert(`📋 Скопировано ${{msg.count}} строк`);
+                return;
+            }}
+            const blob = new Blob([msg.buffer], {{ type: 'text/csv' }});
             const url = window.URL.createObjectURL(blob);
             const a = document.createElement('a');
             a.href = url;
@@ -846,7 +3011,7 @@ html_template = '''<!DOCTYPE html>
             document.getElementById('custom-time-picker').style.display = 'none';
             activePreset = minutes;
             
-            applyFilters();
+            applyTimeFilters();
         }}
         
         function applyCustomTimeRange() {{
@@ -865,7 +3030,7 @@ html_template = '''<!DOCTYPE html>
             }});
             activePreset = null;
             
-            applyFilters();
+            applyTimeFilters();
         }}
         
         function clearCustomTimeRange() {{
@@ -873,7 +3038,7 @@ html_template = '''<!DOCTYPE html>
             document.getElementById('end-time').value = '';
             startTimeFilter = null;
             endTimeFilter = null;
-            applyFilters();
+            applyTimeFilters();
         }}
         
         // Инициализация обработчиков
@@ -902,102 +3067,1463 @@ html_template = '''<!DOCTYPE html>
             document.getElementById('filter-ip').addEventListener('input', applyFilters);
             document.getElementById('filter-status').addEventListener('change', applyFilters);
             document.getElementById('filter-method').addEventListener('change', applyFilters);
+            document.getElementById('filter-ua').addEventListener('change', applyFilters);
+            document.getElementById('clients-panel').addEventListener('click', filterByClientClass);
             document.getElementById('filter-url').addEventListener('input', applyFilters);
             
             // Пагинация
             document.getElementById('page-size').addEventListener('change', function() {{
                 pageSize = parseInt(this.value);
-                currentPage = 1;
-                renderLogs();
+                requestPage(1);
             }});
             
+            // Переключение источника
+            const sourceSelect = document.getElementById('filter-source');
+            sourceSelect.addEventListener('change', selectSource);
+            
+            // Панель топов
+            document.getElementById('top-window').addEventListener('change', refreshTop);
+            document.getElementById('top-panel').addEventListener('click', filterByTopItem);
+            document.getElementById('alert-list').addEventListener('click', filterByAlert);
+            setInterval(refreshTop, 5000);
+            document.getElementById('clients-window').addEventListener('change', refreshClients);
+            document.querySelector('.clients-table thead').addEventListener('click', sortClients);
+            document.getElementById('clients-rows').addEventListener('click', selectClient);
+            setInterval(refreshClients, 5000);
+            setInterval(refreshLatency, 10000);
+            setInterval(refreshTimeline, 10000);
+            
+            // Выделение интервала на таймлайне
+            const timeline = document.getElementById('timeline');
+            timeline.addEventListener('mousedown', startBrush);
+            timeline.addEventListener('mousemove', moveBrush);
+            window.addEventListener('mouseup', endBrush);
+            timeline.addEventListener('dblclick', clearCustomTimeRange);
+            
             // Автоматически загружаем лог
-            loadFullLog();
+            selectSource();
         }};
         
-        // WebSocket для реального времени
-        const evtSource = new EventSource('/stream');
-        evtSource.onmessage = function(e) {{
-            if (!isPaused && e.data) {{
-                try {{
-                    const logData = JSON.parse(e.data);
-                    logs.unshift(logData);
-                    if (logs.length > 10000) logs.pop();
-                    applyFilters();
-                }} catch(e) {{
-                    console.error('Parse error:', e);
-                }}
+        // Топ IP/URL/реферов/агентов (считается на сервере)
+        function refreshTop() {{
+            const minutes = document.getElementById('top-window').value;
+            fetch(`/top?source=${{encodeURIComponent(currentSource)}}&k=10&minutes=${{minutes}}`)
+                .then(response => response.json())
+                .then(data => {{
+                    Object.entries(data).forEach(([field, items]) => {{
+                        const list = document.getElementById(`top-${{field}}`);
+                        list.innerHTML = items.map(item => `
+                            <li data-field="${{field}}" data-value="${{escapeHtml(item.value)}}" title="${{escapeHtml(item.value)}}">
+                                <span class="top-value">${{escapeHtml(item.value)}}</span>
+                                <span class="top-count">${{item.count}}</span>
+                            </li>
+                        `).join('') || '<li>-</li>';
+                    }});
+                }})
+                .catch(error => console.error('Error loading top:', error));
+        }}
+        
+        // Самые активные IP за окно и карточка выбранного IP (счётчики на сервере)
+        let clientsSort = 'count';
+        let selectedClient = null;
+        
+        function refreshClients() {{
+            const minutes = document.getElementById('clients-window').value;
+            fetch(`/clients?source=${{encodeURIComponent(currentSource)}}&minutes=${{minutes}}&sort=${{clientsSort}}&limit=30`)
+                .then(response => response.json())
+                .then(rows => {{
+                    const time = t => new Date(t * 1000).toLocaleTimeString();
+                    document.getElementById('clients-rows').innerHTML = rows.map(r => `
+                        <tr data-ip="${{escapeHtml(r.ip)}}" class="${{r.ip === selectedClient ? 'selected' : ''}}">
+                            <td>${{escapeHtml(r.ip)}}</td><td>${{r.count}}</td><td>${{r.rate}}</td>
+                            <td style="${{r.errors ? 'color: #ff6b6b;' : ''}}">${{r.errors}}</td><td>${{r.total}}</td>
+                            <td>${{time(r.first_seen)}}</td><td>${{time(r.last_seen)}}</td>
+                        </tr>
+                    `).join('') || '<tr><td colspan="7">Нет запросов за окно</td></tr>';
+                    document.querySelectorAll('.clients-table th[data-sort]').forEach(th =>
+                        th.classList.toggle('active', th.dataset.sort === clientsSort));
+                }})
+                .catch(error => console.error('Error loading clients:', error));
+            if (selectedClient) refreshClientDetail();
+        }}
+        
+        function sortClients(e) {{
+            const th = e.target.closest('th[data-sort]');
+            if (!th) return;
+            clientsSort = th.dataset.sort;
+            refreshClients();
+        }}
+        
+        function selectClient(e) {{
+            const row = e.target.closest('tr[data-ip]');
+            if (!row) return;
+            selectedClient = selectedClient === row.dataset.ip ? null : row.dataset.ip;
+            document.getElementById('client-detail').style.display = selectedClient ? '' : 'none';
+            refreshClients();
+        }}
+        
+        function refreshClientDetail() {{
+            const ip = selectedClient;
+            fetch(`/clients?source=${{encodeURIComponent(currentSource)}}&ip=${{encodeURIComponent(ip)}}`)
+                .then(response => response.json())
+                .then(d => {{
+                    if (ip !== selectedClient) return;
+                    const box = document.getElementById('client-detail');
+                    if (!d) {{
+                        box.innerHTML = `${{escapeHtml(ip)}}: IP вытеснен из окна`;
+                        return;
+                    }}
+                    const time = t => new Date(t * 1000).toLocaleString();
+                    const statuses = Object.entries(d.statuses).map(([cls, n]) => `${{cls}}: ${{n}}`).join(', ');
+                    box.innerHTML = `
+                        <div class="panel-title">
+                            <span>🌐 ${{escapeHtml(d.ip)}} <button class="time-preset-btn" id="client-filter-btn">Фильтр по IP</button></span>
+                            <svg id="client-spark" width="300" height="40" title="Запросов в минуту"></svg>
+                        </div>
+                        <span>Впервые: ${{time(d.first_seen)}}</span>
+                        <span>Последний: ${{time(d.last_seen)}}</span>
+                        <span>Всего: ${{d.total}}</span>
+                        <span>Статусы: ${{statuses}}</span>
+                        <span>Пик: ${{Math.max(...d.series.map(p => p.count))}} в мин</span>`;
+                    drawSparkline(document.getElementById('client-spark'), d.series.map(p => p.count));
+                    document.getElementById('client-filter-btn').addEventListener('click', () => {{
+                        document.getElementById('filter-ip').value = d.ip;
+                        applyFilters();
+                    }});
+                }})
+                .catch(error => console.error('Error loading client:', error));
+        }}
+        
+        // Латентность по маршрутам за выбранный временной диапазон
+        function refreshLatency() {{
+            const params = new URLSearchParams({{source: currentSource, limit: 15}});
+            if (startTimeFilter) params.set('start', startTimeFilter);
+            if (endTimeFilter) params.set('end', endTimeFilter);
+            fetch(`/latency?${{params}}`)
+                .then(response => response.json())
+                .then(data => {{
+                    const fmt = v => v === null || v === undefined ? '-' : v.toFixed(3);
+                    document.getElementById('latency-rows').innerHTML = data.routes.map(r => `
+                        <tr>
+                            <td>${{escapeHtml(r.route)}}</td><td>${{r.count}}</td>
+                            <td>${{fmt(r.request_time.p50)}}</td><td>${{fmt(r.request_time.p95)}}</td><td>${{fmt(r.request_time.p99)}}</td>
+                            <td>${{fmt(r.upstream_time.p50)}}</td><td>${{fmt(r.upstream_time.p95)}}</td><td>${{fmt(r.upstream_time.p99)}}</td>
+                        </tr>
+                    `).join('') || '<tr><td colspan="8">Нет $request_time в логе</td></tr>';
+                    drawSparkline(document.getElementById('latency-spark'), data.series.map(p => p.p95));
+                }})
+                .catch(error => console.error('Error loading latency:', error));
+        }}
+        
+        // Алерты детекторов: журнал с сервера, новые приходят событием SSE
+        function refreshAlerts() {{
+            fetch(`/alerts?source=${{encodeURIComponent(currentSource)}}&limit=50`)
+                .then(response => response.json())
+                .then(data => {{
+                    alertItems = data;
+                    renderAlerts();
+                }})
+                .catch(error => console.error('Error loading alerts:', error));
+        }}
+        
+        function renderAlerts() {{
+            document.getElementById('alert-list').innerHTML = alertItems.map((a, i) => `
+                <li data-index="${{i}}">
+                    <span class="alert-${{a.kind}}">${{a.kind === 'spike' ? '▲' : '▼'}} ${{escapeHtml(a.series)}}</span>
+                    ${{a.detail ? escapeHtml(a.detail) : ''}} -
+                    ${{a.value}} при базе ${{a.baseline}} (${{a.score > 0 ? '+' : ''}}${{a.score}}σ),
+                    ${{new Date(a.time * 1000).toLocaleString()}}${{currentSource === '*' ? ' · ' + escapeHtml(a.source) : ''}}
+                </li>
+            `).join('') || '<li>Всплесков не было</li>';
+        }}
+        
+        function addAlert(alert) {{
+            alertItems.unshift(alert);
+            alertItems.length = Math.min(alertItems.length, 50);
+            renderAlerts();
+        }}
+        
+        // Клик по алерту: фильтр на минуту всплеска (и IP / класс статуса)
+        function filterByAlert(e) {{
+            const item = e.target.closest('li[data-index]');
+            if (!item) return;
+            const alert = alertItems[item.dataset.index];
+            if (alert.series === 'ip') document.getElementById('filter-ip').value = alert.detail;
+            if (alert.series === '4xx' || alert.series === '5xx') document.getElementById('filter-status').value = alert.series;
+            startTimeFilter = alert.time - 300;
+            endTimeFilter = alert.time + 60;
+            activePreset = null;
+            document.querySelectorAll('.time-preset-btn').forEach(btn => {{
+                btn.classList.remove('active');
+            }});
+            applyTimeFilters();
+        }}
+        
+        // Гистограмма запросов: корзины считает сервер по всему файлу
+        function refreshTimeline() {{
+            const params = new URLSearchParams({{source: currentSource, buckets: 120}});
+            if (startTimeFilter) params.set('start', startTimeFilter);
+            if (endTimeFilter) params.set('end', endTimeFilter);
+            fetch(`/histogram?${{params}}`)
+                .then(response => response.json())
+                .then(data => {{
+                    timelineData = data;
+                    drawTimeline();
+                }})
+                .catch(error => console.error('Error loading histogram:', error));
+        }}
+        
+        function drawTimeline() {{
+            const svg = document.getElementById('timeline');
+            const w = svg.clientWidth || 800, h = svg.clientHeight || 90;
+            svg.setAttribute('viewBox', `0 0 ${{w}} ${{h}}`);
+            const data = timelineData;
+            if (!data || !data.points.length) {{
+                svg.innerHTML = '';
+                document.getElementById('timeline-step').textContent = 'нет данных';
+                document.getElementById('timeline-from').textContent = '';
+                document.getElementById('timeline-to').textContent = '';
+                return;
             }}
-        }};
+            const span = Math.max(data.end - data.start, data.step);
+            const max = Math.max(...data.points.map(p => p[1])) || 1;
+            const barWidth = Math.max(data.step / span * w - 1, 1);
+            const bar = (x, value, offset, color) => {{
+                const height = value / max * (h - 2);
+                return `<rect x="${{x.toFixed(1)}}" y="${{(h - offset - height).toFixed(1)}}" width="${{barWidth.toFixed(1)}}" height="${{height.toFixed(1)}}" fill="${{color}}"/>`;
+            }};
+            svg.innerHTML = data.points.map(([t, total, c4, c5]) => {{
+                const x = (t - data.start) / span * w;
+                const ok = total - c4 - c5;
+                const okHeight = ok / max * (h - 2);
+                const c4Height = c4 / max * (h - 2);
+                return `<g><title>${{new Date(t * 1000).toLocaleString()}}: ${{total}} (4xx ${{c4}}, 5xx ${{c5}})</title>` +
+                    bar(x, ok, 0, '#7aa2f7') + bar(x, c4, okHeight, '#e0af68') + bar(x, c5, okHeight + c4Height, '#f7768e') + '</g>';
+            }}).join('') + '<rect id="timeline-brush" x="0" y="0" width="0" height="' + h + '" fill="#7aa2f7" fill-opacity="0.2"/>';
+            const stepLabel = data.step >= 3600 ? `${{data.step / 3600}} ч` : `${{data.step / 60}} мин`;
+            document.getElementById('timeline-step').textContent = `шаг ${{stepLabel}} · выделите интервал`;
+            document.getElementById('timeline-from').textContent = new Date(data.start * 1000).toLocaleString();
+            document.getElementById('timeline-to').textContent = new Date(data.end * 1000).toLocaleString();
+        }}
         
-        evtSource.onerror = function() {{
-            console.log('Reconnecting...');
-        }};
+        function timelineTime(e) {{
+            const rect = e.currentTarget.getBoundingClientRect();
+            const ratio = Math.min(Math.max((e.clientX - rect.left) / rect.width, 0), 1);
+            return {{x: ratio * rect.width, t: timelineData.start + ratio * (timelineData.end - timelineData.start)}};
+        }}
+        
+        function startBrush(e) {{
+            if (!timelineData || !timelineData.points.length) return;
+            brush = timelineTime(e);
+            brush.current = brush;
+        }}
+        
+        function moveBrush(e) {{
+            if (!brush) return;
+            brush.current = timelineTime(e);
+            const rect = document.getElementById('timeline-brush');
+            if (!rect) return;
+            rect.setAttribute('x', Math.min(brush.x, brush.current.x));
+            rect.setAttribute('width', Math.abs(brush.current.x - brush.x));
+        }}
+        
+        // Выделенный интервал становится временным фильтром (и масштабом таймлайна)
+        function endBrush() {{
+            if (!brush) return;
+            const from = Math.min(brush.t, brush.current.t), to = Math.max(brush.t, brush.current.t);
+            const wide = Math.abs(brush.current.x - brush.x) > 3;
+            brush = null;
+            if (!wide) {{
+                drawTimeline();
+                return;
+            }}
+            startTimeFilter = from;
+            endTimeFilter = to;
+            activePreset = null;
+            document.querySelectorAll('.time-preset-btn').forEach(btn => {{
+                btn.classList.remove('active');
+            }});
+            applyTimeFilters();
+        }}
+        
+        function drawSparkline(svg, values) {{
+            const w = svg.width.baseVal.value, h = svg.height.baseVal.value;
+            if (values.length < 2) {{
+                svg.innerHTML = '';
+                return;
+            }}
+            const max = Math.max(...values) || 1;
+            const points = values.map((v, i) =>
+                `${{(i / (values.length - 1) * w).toFixed(1)}},${{(h - v / max * (h - 2) - 1).toFixed(1)}}`).join(' ');
+            svg.innerHTML = `<polyline points="${{points}}" fill="none" stroke="#7aa2f7" stroke-width="1.5"/>`;
+        }}
+        
+        function filterByTopItem(e) {{
+            const item = e.target.closest('li[data-field]');
+            if (!item) return;
+            const input = {{ip: 'filter-ip', url: 'filter-url'}}[item.dataset.field];
+            if (!input) return;
+            document.getElementById(input).value = item.dataset.value;
+            applyFilters();
+        }}
+        
+        function selectSource() {{
+            const sourceSelect = document.getElementById('filter-source');
+            currentSource = sourceSelect.value;
+            const option = sourceSelect.selectedOptions[0];
+            document.getElementById('source-path').textContent =
+                `📁 ${{option && option.dataset.path ? option.dataset.path : option ? option.textContent : ''}}`;
+            connectStream();
+            loadFullLog();
+            refreshTop();
+            selectedClient = null;
+            refreshClients();
+            refreshLatency();
+            refreshTimeline();
+            refreshAlerts();
+        }}
+        
+        // SSE для реального времени: строки разбирает воркер
+        function connectStream() {{
+            if (evtSource) evtSource.close();
+            evtSource = new EventSource(`/stream?source=${{encodeURIComponent(currentSource)}}&format=${{WIRE_FORMAT}}`);
+            // Словарь компактного формата живёт в пределах одного соединения
+            evtSource.onopen = function() {{
+                worker.postMessage({{type: 'stream-reset'}});
+            }};
+            evtSource.onmessage = function(e) {{
+                if (e.data) {{
+                    worker.postMessage({{type: 'line', data: e.data}});
+                }}
+            }};
+            
+            evtSource.addEventListener('alert', function(e) {{
+                addAlert(JSON.parse(e.data));
+            }});
+            
+            evtSource.onerror = function() {{
+                console.log('Reconnecting...');
+            }};
+        }}
     </script>
 </body>
 </html>
 '''
 
-def handle_client(client):
+worker_script = r'''// Воркер страницы: хранит записи колонками (typed arrays) и выполняет
+// фильтрацию, сортировку, статистику и экспорт вне основного потока.
+// Основной поток получает только видимую страницу и статистику.
+'use strict';
+
+const STRING_FIELDS = ['ip', 'method', 'url', 'source', 'ua'];
+const HUMAN_CLASSES = ['browser', 'mobile'];
+const DETAIL_BATCH = 5000;
+let maxEntries = 200000;
+let wireFormat = 'compact';
+
+// Колонки: строки хранятся кодами интернированных словарей
+let length = 0;
+let capacity = 0;
+let cols = {};
+let dicts = {};
+let version = 0;      // Меняется при любом изменении данных
+
+// Состояние последнего запроса
+let query = null;
+let filtered = new Uint32Array(0);
+let filteredCount = 0;
+let filteredKey = null;
+let sortedKey = null;
+let stats = null;
+let pendingRun = false;
+
+// Поток
+let paused = false;
+let loading = false;
+let streamBacklog = [];
+let streamMap = {};
+let refreshTimer = null;
+
+// Словари сбрасываются только при init: streamMap открытого потока ссылается
+// на их коды, а сервер уже отправленные значения повторно не присылает.
+// Освободившиеся значения убирает compact()
+function reset(clearDicts) {
+    length = 0;
+    capacity = 0;
+    cols = {};
+    if (clearDicts) {
+        dicts = {};
+        STRING_FIELDS.forEach(f => dicts[f] = {values: [], index: new Map(), order: [], rank: null});
+    }
+    grow(1024);
+    version++;
+}
+
+function grow(min) {
+    let next = Math.max(capacity * 2, min);
+    const make = (Type, old) => {
+        const arr = new Type(next);
+        if (old) arr.set(old.subarray(0, length));
+        return arr;
+    };
+    cols = {
+        time: make(Float64Array, cols.time),
+        status: make(Uint16Array, cols.status),
+        size: make(Float64Array, cols.size),
+        rt: make(Float32Array, cols.rt),
+        urt: make(Float32Array, cols.urt),
+        id: make(Float64Array, cols.id),    // id записи для /detail (NaN - нет)
+        ...Object.fromEntries(STRING_FIELDS.map(f => [f, make(Int32Array, cols[f])]))
+    };
+    capacity = next;
+}
+
+function intern(field, value) {
+    const d = dicts[field];
+    value = value === undefined || value === null ? '' : String(value);
+    let code = d.index.get(value);
+    if (code === undefined) {
+        code = d.values.length;
+        d.values.push(value);
+        d.index.set(value, code);
+    }
+    return code;
+}
+
+// Пересобираем словари по живым колонкам: остаются значения строк в памяти
+// и коды, на которые ссылается streamMap открытого потока
+function compact() {
+    for (const f of STRING_FIELDS) {
+        const d = dicts[f], codes = cols[f];
+        const used = new Uint8Array(d.values.length);
+        for (let i = 0; i < length; i++) used[codes[i]] = 1;
+        const pinned = streamMap[f] || [];
+        for (const c of pinned) used[c] = 1;
+        const remap = new Int32Array(d.values.length).fill(-1);
+        const values = [];
+        const index = new Map();
+        for (let c = 0; c < d.values.length; c++) {
+            if (!used[c]) continue;
+            remap[c] = values.length;
+            index.set(d.values[c], values.length);
+            values.push(d.values[c]);
+        }
+        if (values.length === d.values.length) continue;
+        for (let i = 0; i < length; i++) codes[i] = remap[codes[i]];
+        for (let k = 0; k < pinned.length; k++) pinned[k] = remap[pinned[k]];
+        // Порядок сортировки сохраняется, меняются только коды
+        d.order = d.order.filter(c => remap[c] >= 0).map(c => remap[c]);
+        d.values = values;
+        d.index = index;
+        d.rank = null;
+    }
+}
+
+function appendRow(t, codes, status, size, rt, urt, id) {
+    if (length >= capacity) grow(length + 1);
+    const i = length++;
+    cols.time[i] = t;
+    cols.status[i] = status;
+    cols.size[i] = size;
+    cols.rt[i] = rt === null || rt === undefined ? NaN : rt;
+    cols.urt[i] = urt === null || urt === undefined ? NaN : urt;
+    cols.id[i] = id === null || id === undefined ? NaN : id;
+    STRING_FIELDS.forEach((f, k) => cols[f][i] = codes[k]);
+}
+
+function appendObject(e) {
+    appendRow(e.sort_time, STRING_FIELDS.map(f => intern(f, e[f])), e.status, parseInt(e.size) || 0,
+              e.request_time, e.upstream_time, e.id);
+}
+
+// Компактный формат (WireEncoder): коды сообщения -> коды словарей воркера
+function decodeCompact(msg, map, newestFirst) {
+    for (const [field, values] of Object.entries(msg.dict)) {
+        const target = map[field] || (map[field] = []);
+        for (const value of values) target.push(intern(field, value));
+    }
+    const code = (field, c) => typeof c === 'string' ? intern(field, c) : map[field][c];
+    const rows = msg.rows;
+    const times = new Float64Array(rows.length);
+    const ids = new Float64Array(rows.length);
+    let t = 0, id = 0;
+    for (let i = 0; i < rows.length; i++) {
+        t += rows[i][0];
+        times[i] = t;
+        if (rows[i][9] === null) ids[i] = NaN;
+        else ids[i] = id += rows[i][9];
+    }
+    for (let k = 0; k < rows.length; k++) {
+        const i = newestFirst ? rows.length - 1 - k : k;
+        const r = rows[i];
+        appendRow(times[i],
+                  [code('ip', r[1]), code('method', r[2]), code('url', r[3]), code('source', r[8]), code('ua', r[10])],
+                  r[4], r[5],
+                  r[6] === null ? null : r[6] / 1000, r[7] === null ? null : r[7] / 1000, ids[i]);
+    }
+}
+
+// Вытесняем самые старые записи, если превышен лимит
+function trim() {
+    if (length <= maxEntries) return;
+    const drop = length - Math.floor(maxEntries * 0.9);
+    for (const name of Object.keys(cols)) cols[name].copyWithin(0, drop, length);
+    length -= drop;
+    compact();
+}
+
+function formatTimestamp(sortTime) {
+    const d = new Date(sortTime * 1000);
+    const pad = n => String(n).padStart(2, '0');
+    return `${pad(d.getDate())}.${pad(d.getMonth() + 1)}.${d.getFullYear()} ${pad(d.getHours())}:${pad(d.getMinutes())}`;
+}
+
+function entry(i) {
+    const value = f => dicts[f].values[cols[f][i]];
+    return {
+        sort_time: cols.time[i],
+        timestamp: formatTimestamp(cols.time[i]),
+        ip: value('ip'),
+        method: value('method'),
+        url: value('url'),
+        status: cols.status[i],
+        size: cols.size[i],
+        request_time: isNaN(cols.rt[i]) ? null : cols.rt[i],
+        upstream_time: isNaN(cols.urt[i]) ? null : cols.urt[i],
+        source: value('source'),
+        ua: value('ua'),
+        id: isNaN(cols.id[i]) ? null : cols.id[i]
+    };
+}
+
+// Фильтр подстроки считается один раз на значение словаря, а не на строку
+function matchDict(field, needle) {
+    if (!needle) return null;
+    const values = dicts[field].values;
+    const match = new Uint8Array(values.length);
+    for (let c = 0; c < values.length; c++) {
+        if (values[c].toLowerCase().includes(needle)) match[c] = 1;
+    }
+    return match;
+}
+
+// Класс клиента из метки "класс/семейство"; 'human' - браузеры и мобильные
+function matchClass(wanted) {
+    if (!wanted) return null;
+    const values = dicts.ua.values;
+    const match = new Uint8Array(values.length);
+    for (let c = 0; c < values.length; c++) {
+        const cls = values[c].split('/')[0];
+        if (cls === wanted || (wanted === 'human' && HUMAN_CLASSES.includes(cls))) match[c] = 1;
+    }
+    return match;
+}
+
+// Разбивка по классам и семействам клиентов: счётчики по кодам меток
+function clientStats(counts) {
+    const classes = {};
+    const families = [];
+    dicts.ua.values.forEach((label, c) => {
+        if (!counts[c]) return;
+        const cls = label.split('/')[0];
+        classes[cls] = (classes[cls] || 0) + counts[c];
+        families.push([label, counts[c]]);
+    });
+    families.sort((a, b) => b[1] - a[1]);
+    return {classes, families: families.slice(0, 10)};
+}
+
+function filter(q) {
+    const ipMatch = matchDict('ip', q.ip.toLowerCase());
+    const urlMatch = matchDict('url', q.url.toLowerCase());
+    const uaMatch = matchClass(q.ua);
+    const methodCode = q.method ? dicts.method.index.get(q.method) : null;
+    let statusLo = 0, statusHi = 65535;
+    if (q.status === '4xx') [statusLo, statusHi] = [400, 499];
+    else if (q.status === '5xx') [statusLo, statusHi] = [500, 599];
+    else if (q.status && !isNaN(q.status)) statusLo = statusHi = parseInt(q.status);
+    const start = q.start || -Infinity;
+    const end = q.end || Infinity;
+
+    if (filtered.length < length) filtered = new Uint32Array(capacity);
+    const ipSeen = new Uint8Array(dicts.ip.values.length);
+    const uaCounts = new Uint32Array(dicts.ua.values.length);
+    let count = 0, errors = 0, uniqueIPs = 0, oldest = Infinity, newest = -Infinity;
+    const {time, status, ip, url, method, ua} = cols;
+    // Метода нет в словаре - совпадений нет
+    if (!(q.method && methodCode === undefined)) {
+        for (let i = 0; i < length; i++) {
+            const s = status[i];
+            if (s < statusLo || s > statusHi) continue;
+            const t = time[i];
+            if (t < start || t > end) continue;
+            if (ipMatch && !ipMatch[ip[i]]) continue;
+            if (urlMatch && !urlMatch[url[i]]) continue;
+            if (methodCode !== null && method[i] !== methodCode) continue;
+            if (uaMatch && !uaMatch[ua[i]]) continue;
+            filtered[count++] = i;
+            uaCounts[ua[i]]++;
+            if (s >= 400) errors++;
+            if (!ipSeen[ip[i]]) {
+                ipSeen[ip[i]] = 1;
+                uniqueIPs++;
+            }
+            if (t < oldest) oldest = t;
+            if (t > newest) newest = t;
+        }
+    }
+    filteredCount = count;
+    stats = {count, errors, uniqueIPs, oldest: count ? oldest : null, newest: count ? newest : null,
+             clients: clientStats(uaCounts)};
+}
+
+// Порядок строк словаря, чтобы сортировать по строковым полям числами.
+// Новые значения сортируются отдельно и вливаются в готовый порядок
+function rank(field) {
+    const d = dicts[field], values = d.values;
+    const cmp = (a, b) => values[a] < values[b] ? -1 : values[a] > values[b] ? 1 : 0;
+    if (d.order.length < values.length) {
+        const added = [];
+        for (let c = d.order.length; c < values.length; c++) added.push(c);
+        added.sort(cmp);
+        const order = [];
+        let i = 0, j = 0;
+        while (i < d.order.length || j < added.length) {
+            if (j >= added.length || (i < d.order.length && cmp(d.order[i], added[j]) <= 0)) order.push(d.order[i++]);
+            else order.push(added[j++]);
+        }
+        d.order = order;
+        d.rank = null;
+    }
+    if (!d.rank) {
+        d.rank = new Uint32Array(values.length);
+        d.order.forEach((c, r) => d.rank[c] = r);
+    }
+    return d.rank;
+}
+
+function sort(field, direction) {
+    let key;
+    if (field === 'status') key = cols.status;
+    else if (field === 'size') key = cols.size;
+    else if (STRING_FIELDS.includes(field)) {
+        const r = rank(field), codes = cols[field];
+        key = new Uint32Array(length);
+        for (let i = 0; i < length; i++) key[i] = r[codes[i]];
+    } else key = cols.time;
+    const sign = direction === 'asc' ? 1 : -1;
+    // При равенстве - более поздние по приходу выше
+    filtered.subarray(0, filteredCount).sort((a, b) => (key[a] - key[b]) * sign || b - a);
+}
+
+function run() {
+    pendingRun = false;
+    if (!query) return;
+    const q = query;
+    const fKey = JSON.stringify([version, q.ip, q.url, q.method, q.status, q.ua, q.start, q.end]);
+    if (fKey !== filteredKey) {
+        filter(q);
+        filteredKey = fKey;
+        sortedKey = null;
+    }
+    const sKey = fKey + q.sortField + q.sortDirection;
+    if (sKey !== sortedKey) {
+        sort(q.sortField, q.sortDirection);
+        sortedKey = sKey;
+    }
+    const totalPages = Math.max(1, Math.ceil(filteredCount / q.pageSize));
+    const page = Math.min(Math.max(q.page, 1), totalPages);
+    const from = (page - 1) * q.pageSize;
+    const to = Math.min(from + q.pageSize, filteredCount);
+    const rows = [];
+    for (let k = from; k < to; k++) rows.push(entry(filtered[k]));
+    postMessage({type: 'result', id: q.id, rows, stats, page, from, to, filtered: filteredCount, total: length});
+}
+
+function schedule() {
+    if (!pendingRun) {
+        pendingRun = true;
+        setTimeout(run, 0);
+    }
+}
+
+// Строки потока: пересчёт не чаще раза в 250 мс
+function ingest(text) {
+    if (paused) return;
+    if (loading) {
+        streamBacklog.push(text);
+        return;
+    }
+    const data = JSON.parse(text);
+    if (wireFormat === 'compact') decodeCompact(data, streamMap, false);
+    else appendObject(data);
+    trim();
+    version++;
+    if (!refreshTimer) {
+        refreshTimer = setTimeout(() => {
+            refreshTimer = null;
+            schedule();
+        }, 250);
+    }
+}
+
+async function load(url, label) {
+    loading = true;
+    const started = performance.now();
+    try {
+        const response = await fetch(url);
+        const text = await response.text();
+        const received = performance.now();
+        const data = JSON.parse(text);
+        reset();
+        if (wireFormat === 'compact') decodeCompact(data, {}, true);
+        else for (let i = data.length - 1; i >= 0; i--) appendObject(data[i]);
+        trim();
+        compact();
+        postMessage({type: 'loaded', label, total: length,
+                     bytes: text.length, fetchMs: received - started, decodeMs: performance.now() - received});
+    } catch (error) {
+        postMessage({type: 'error', label, message: String(error)});
+    } finally {
+        loading = false;
+        const backlog = streamBacklog;
+        streamBacklog = [];
+        backlog.forEach(ingest);
+        version++;
+        schedule();
+    }
+}
+
+function rawLine(e, d) {
+    return d && d.raw ? d.raw.replace(/\n$/, '') :
+        `${e.ip} - - [${e.timestamp}] "${e.method} ${e.url}" ${e.status} ${e.size} "${d ? d.referer : '-'}" "${d ? d.agent : '-'}"`;
+}
+
+// raw/referer/agent в списках не хранятся - дозапрашиваем по id пачками
+async function fetchDetails(rows) {
+    const bySource = new Map();
+    for (const e of rows) {
+        if (e.id === null) continue;
+        if (!bySource.has(e.source)) bySource.set(e.source, []);
+        bySource.get(e.source).push(e.id);
+    }
+    const found = new Map();
+    for (const [source, ids] of bySource) {
+        for (let k = 0; k < ids.length; k += DETAIL_BATCH) {
+            try {
+                const body = new URLSearchParams({source, ids: ids.slice(k, k + DETAIL_BATCH).join(',')});
+                const response = await fetch('/detail', {method: 'POST', body});
+                for (const d of await response.json()) found.set(`${source} ${d.id}`, d);
+            } catch (error) {
+                console.error('Detail error:', error);
+            }
+        }
+    }
+    return found;
+}
+
+// Экспорт собирается здесь, в основной поток уходит буфер (transferable)
+async function exportRows(kind) {
+    const rows = [];
+    for (let k = 0; k < filteredCount; k++) rows.push(entry(filtered[k]));
+    const details = await fetchDetails(rows);
+    const parts = kind === 'csv' ? ['Timestamp,IP,Method,URL,Status,Size,Referer,User Agent\n'] : [];
+    rows.forEach((e, k) => {
+        const d = details.get(`${e.source} ${e.id}`);
+        parts.push(kind === 'csv'
+            ? `"${e.timestamp}","${e.ip}","${e.method}","${e.url}","${e.status}","${e.size}","${d ? d.referer : ''}","${d ? d.agent : ''}"\n`
+            : rawLine(e, d) + (k + 1 < rows.length ? '\n' : ''));
+    });
+    const buffer = new TextEncoder().encode(parts.join('')).buffer;
+    postMessage({type: 'export', kind, count: rows.length, buffer}, [buffer]);
+}
+
+onmessage = function(e) {
+    const msg = e.data;
+    switch (msg.type) {
+        case 'init':
+            maxEntries = msg.maxEntries;
+            wireFormat = msg.wireFormat;
+            reset(true);
+            break;
+        case 'load':
+            load(msg.url, msg.label);
+            break;
+        case 'stream-reset':
+            streamMap = {};
+            break;
+        case 'line':
+            try {
+                ingest(msg.data);
+            } catch (error) {
+                console.error('Parse error:', error);
+            }
+            break;
+        case 'pause':
+            paused = msg.paused;
+            break;
+        case 'query':
+            query = msg.query;
+            schedule();
+            break;
+        case 'export':
+            exportRows(msg.kind);
+            break;
+    }
+};
+'''
+
+def parse_request(request):
+    """Разбирает первую строку HTTP-запроса: путь и параметры"""
+    try:
+        target = request.split('\r\n', 1)[0].split(' ')[1]
+    except IndexError:
+        return '/', {}
+    url = urlsplit(target)
+    params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+    return url.path, params
+
+def read_request(client):
+    """Читает заголовки и тело запроса; параметры формы из тела (POST)
+    добавляются к параметрам строки запроса"""
+    data = b''
+    while b'\r\n\r\n' not in data and len(data) < max_request_bytes:
+        chunk = client.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    head, _, body = data.partition(b'\r\n\r\n')
+    request = head.decode('latin-1')
+    path, params = parse_request(request)
+    length = 0
+    for line in request.split('\r\n')[1:]:
+        name, _, value = line.partition(':')
+        if name.strip().lower() == 'content-length' and value.strip().isdigit():
+            length = min(int(value), max_request_bytes)
+    while len(body) < length:
+        chunk = client.recv(65536)
+        if not chunk:
+            break
+        body += chunk
+    if length:
+        form = parse_qs(body[:length].decode('utf-8', errors='replace'))
+        params.update({key: values[-1] for key, values in form.items()})
+    return path, params
+
+def serve_client(client, routes):
+    """Поток соединения: чтение запроса и вызов обработчика маршрута"""
+    try:
+        path, params = read_request(client)
+    except (OSError, UnicodeError):
+        client.close()
+        return
+    routes.get(path, handle_client)(client, params)
+
+def handle_client(client, params):
     client.send(b'HTTP/1.1 200 OK\r\n')
     client.send(b'Content-Type: text/html; charset=utf-8\r\n')
     client.send(b'Connection: close\r\n')
     client.send(b'\r\n')
     
-    # Собираем уникальные статусы из всего лога
-    status_codes = collect_status_codes()
+    # Статусы берём из индексов источников, файл заново не читаем
+    statuses = set()
+    for src in sources.values():
+        with src.lock:
+            statuses |= src.status_codes
     status_options = ''
-    for code in status_codes:
+    for code in with_common_statuses(statuses):
         status_options += f'<option value="{code}">{code}</option>\n'
     
-    html = html_template.format(log_file=log_file, status_options=status_options)
+    source_options = ''
+    if len(sources) > 1:
+        source_options += f'<option value="{ALL_SOURCES}">Все источники</option>\n'
+    for name, src in sources.items():
+        source_options += f'<option value="{name}" data-path="{src.path}">{name}</option>\n'
+    
+    first = next(iter(sources.values()))
+    html = html_template.format(log_file=first.path,
+                                status_options=status_options,
+                                source_options=source_options)
     client.send(html.encode())
     client.close()
 
-def handle_stream(client):
-    client.send(b'HTTP/1.1 200 OK\r\n')
-    client.send(b'Content-Type: text/event-stream\r\n')
-    client.send(b'Cache-Control: no-cache\r\n')
-    client.send(b'Connection: keep-alive\r\n')
-    client.send(b'\r\n')
-    
-    proc = subprocess.Popen(['tail', '-f', log_file], 
-                          stdout=subprocess.PIPE, 
-                          stderr=subprocess.PIPE,
-                          text=True,
-                          bufsize=1)
+class SSEWriter:
+    """Неблокирующая запись в SSE-сокет с ограниченным буфером
+
+    send() никогда не ждёт клиента: что не ушло, остаётся в буфере.
+    Переполненный или долго не уменьшающийся буфер означает, что клиент
+    не читает - соединение закрывается (EventSource сам переподключится).
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.buffer = bytearray()
+        self.stalled_since = None
+        self.last_write = time.time()
+        client.setblocking(False)
+
+    def write(self, data):
+        if len(self.buffer) + len(data) > sse_max_buffer:
+            raise ConnectionError('клиент не успевает читать поток')
+        self.buffer += data
+        self.last_write = time.time()
+        self.flush()
+
+    def flush(self):
+        progress = False
+        while self.buffer:
+            try:
+                sent = self.client.send(self.buffer)
+            except BlockingIOError:
+                break
+            del self.buffer[:sent]
+            progress = progress or sent > 0
+        # Медленный, но читающий клиент не отключается: таймаут идёт только
+        # пока в сокет не уходит ни байта
+        if not self.buffer or progress:
+            self.stalled_since = None if not self.buffer else time.time()
+        elif self.stalled_since is None:
+            self.stalled_since = time.time()
+        elif time.time() - self.stalled_since > sse_stall_timeout:
+            raise ConnectionError('клиент перестал читать поток')
+
+    def closed(self):
+        """Браузер закрыл соединение: сокет читается и recv отдаёт EOF"""
+        readable, _, _ = select.select([self.client], [], [], 0)
+        if not readable:
+            return False
+        try:
+            return self.client.recv(4096) == b''
+        except BlockingIOError:
+            return False
+        except OSError:
+            return True
+
+def handle_stream(client, params):
+    selected = resolve_sources(params.get('source', ''))
+    encoder = WireEncoder() if params.get('format') == 'compact' else None
+    # fields=full - записи целиком (для узлов-агрегаторов), иначе поля списка
+    project = (lambda parsed: parsed) if params.get('fields') == 'full' else list_entry
+    q = queue.Queue(maxsize=1000)
+    for src in selected:
+        src.subscribe(q)
     
+    writer = SSEWriter(client)
     try:
+        writer.write(b'HTTP/1.1 200 OK\r\n'
+                     b'Content-Type: text/event-stream\r\n'
+                     b'Cache-Control: no-cache\r\n'
+                     b'Connection: keep-alive\r\n'
+                     b'\r\n')
         while True:
-            line = proc.stdout.readline()
-            if line:
-                parsed = parse_log_line(line)
-                if parsed:
-                    client.send(f'data: {json.dumps(parsed)}\n\n'.encode())
-    except:
-        proc.kill()
+            # Ждём строки не дольше интервала проверки, чтобы на тихом логе
+            # заметить ушедшего клиента и вовремя отправить пульс
+            try:
+                batch = [q.get(timeout=sse_check_interval)]
+            except queue.Empty:
+                batch = []
+            while batch and len(batch) < sse_batch:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            # Алерты детекторов идут отдельным типом события
+            events = [item for item in batch if isinstance(item, tuple)]
+            if events:
+                batch = [item for item in batch if not isinstance(item, tuple)]
+                writer.write(''.join(f'event: {kind}\ndata: {json.dumps(payload)}\n\n'
+                                     for kind, payload in events).encode())
+            if batch and encoder:
+                writer.write(f'data: {encoder.dumps(batch)}\n\n'.encode())
+            elif batch:
+                writer.write(''.join(f'data: {json.dumps(project(parsed))}\n\n' for parsed in batch).encode())
+            elif time.time() - writer.last_write >= sse_heartbeat:
+                writer.write(b': ping\n\n')
+            else:
+                writer.flush()
+            if writer.closed():
+                break
+    except OSError:
+        pass
     finally:
+        for src in selected:
+            src.unsubscribe(q)
         client.close()
 
-def handle_full_log(client):
-    """Отдаёт ВЕСЬ лог-файл для начальной загрузки"""
+def send_json(client, data, encoded=None):
     client.send(b'HTTP/1.1 200 OK\r\n')
     client.send(b'Content-Type: application/json\r\n')
     client.send(b'Connection: close\r\n')
     client.send(b'\r\n')
-    
-    logs = load_full_log()
-    client.send(json.dumps(logs).encode())
+    client.sendall((encoded or json.dumps(data)).encode())
+    client.close()
+
+def send_entries(client, logs, params):
+    """Список записей в формате из ?format= (json или compact)"""
+    if params.get('format') == 'compact':
+        send_json(client, None, WireEncoder().dumps(logs))
+    else:
+        send_json(client, logs)
+
+def int_param(params, name, default, low=1, high=None):
+    """Целый параметр запроса с ограничением диапазона"""
+    try:
+        value = int(params.get(name, default))
+    except ValueError:
+        value = default
+    value = max(low, value)
+    return min(value, high) if high is not None else value
+
+def handle_worker(client, params):
+    """Скрипт Web Worker'а страницы (фильтрация и сортировка вне основного потока)"""
+    client.send(b'HTTP/1.1 200 OK\r\n')
+    client.send(b'Content-Type: application/javascript; charset=utf-8\r\n')
+    client.send(b'Cache-Control: max-age=3600\r\n')
+    client.send(b'Connection: close\r\n')
+    client.send(b'\r\n')
+    client.sendall(worker_script.encode())
     client.close()
 
+def handle_full_log(client, params):
+    """Отдаёт ВЕСЬ лог-файл для начальной загрузки"""
+    logs = merged_entries(resolve_sources(params.get('source', '')))
+    if params.get('fields') == 'full':
+        logs = full_entries(logs)
+    send_entries(client, logs, params)
+
+def full_entries(logs):
+    """Записи списка с полными полями; ненайденные остаются как есть"""
+    ids = {}
+    for e in logs:
+        if e.get('id') is not None:
+            ids.setdefault(e.get('source'), []).append(e['id'])
+    found = {}
+    for name, wanted in ids.items():
+        if name in sources:
+            found.update(((name, parsed['id']), parsed) for parsed in sources[name].details(wanted))
+    return [found.get((e.get('source'), e.get('id')), e) for e in logs]
+
+def handle_detail(client, params):
+    """Полные записи по id из списка: /detail?source=NAME&ids=1,2,3 (GET или POST)"""
+    src = sources.get(params.get('source', ''))
+    ids = []
+    for value in params.get('ids', '').split(','):
+        try:
+            ids.append(int(value))
+        except ValueError:
+            pass
+    send_json(client, src.details(ids[:detail_max_ids]) if src and ids else [])
+
+def float_param(params, name):
+    try:
+        return float(params[name])
+    except (KeyError, ValueError):
+        return None
+
+def handle_search(client, params):
+    """Запрос по всему файлу (mmap + кэш), новые сверху
+
+    Параметры: q (подстрока с учётом регистра, icase=1 - без), status, ip, method, start/end или minutes, limit.
+    """
+    selected = resolve_sources(params.get('source', ''))
+    query = LogQuery(params)
+    results = [src.search(query) for src in selected]
+    merged = heapq.merge(*results, key=lambda e: e['sort_time'], reverse=True)
+    send_entries(client, list(islice(merged, query.limit)), params)
+
+def handle_histogram(client, params):
+    """Запросы и 4xx/5xx по корзинам из поминутных счётчиков"""
+    selected = resolve_sources(params.get('source', ''))
+    buckets = int_param(params, 'buckets', 120, low=10, high=1000)
+    send_json(client, histogram(selected, float_param(params, 'start'), float_param(params, 'end'), buckets))
+
+def handle_alerts(client, params):
+    """Последние алерты детекторов, новые сверху; since - id последнего увиденного"""
+    names = {src.name for src in resolve_sources(params.get('source', ''))}
+    since = int_param(params, 'since', 0, low=0)
+    limit = int_param(params, 'limit', 50, high=alerts.maxlen)
+    # Снимок: тейлер дописывает журнал, а по deque нельзя идти во время изменения
+    found = [alert for alert in reversed(list(alerts)) if alert['source'] in names and alert['id'] > since]
+    send_json(client, found[:limit])
+
+def handle_latency(client, params):
+    """p50/p95/p99 времени ответа по маршрутам и во времени"""
+    selected = resolve_sources(params.get('source', ''))
+    start, end = float_param(params, 'start'), float_param(params, 'end')
+    step = int_param(params, 'step', 60, low=60)
+    limit = int_param(params, 'limit', 20, high=latency_max_routes)
+    send_json(client, latency_stats(selected, start, end, params.get('route') or None, step, limit))
+
+def handle_top(client, params):
+    """Top-K IP/URL/реферов/агентов за скользящее окно"""
+    selected = resolve_sources(params.get('source', ''))
+    k = int_param(params, 'k', 10, high=top_capacity)
+    minutes = int_param(params, 'minutes', 15, high=top_window_minutes)
+    fields = [params['field']] if params.get('field') in TOP_FIELDS else TOP_FIELDS
+    send_json(client, {field: top_values(selected, field, k, minutes) for field in fields})
+
+def handle_clients(client, params):
+    """Самые активные IP за окно (sort=count|errors|total|last_seen|first_seen)
+    или карточка одного IP (ip=)"""
+    selected = resolve_sources(params.get('source', ''))
+    if params.get('ip'):
+        send_json(client, client_detail(selected, params['ip']))
+        return
+    minutes = int_param(params, 'minutes', 5, high=client_window_minutes)
+    limit = int_param(params, 'limit', 50, high=1000)
+    sort = params.get('sort') if params.get('sort') in CLIENT_SORTS else 'count'
+    send_json(client, clients_stats(selected, minutes, sort, limit))
+
+class BatchReport:
+    """Результат пакетного режима: строки записей или агрегат
+
+    В исполнителях копится часть по своему куску файла (take() отдаёт её и
+    начинает заново), в главном процессе части сливаются в merge().
+    Строки записей форматируются в исполнителях и печатаются сразу.
+    """
+
+    def __init__(self, mode, output='tsv', limit=None):
+        self.mode = mode      # entries, top:ПОЛЕ, latency или histogram
+        self.output = output  # tsv, json или raw (только для записей)
+        self.limit = limit
+        self.printed = 0
+        self.reset()
+
+    def reset(self):
+        if self.mode == 'entries':
+            self.part = []
+        elif self.mode == 'latency':
+            self.part = {}
+        elif self.mode == 'histogram':
+            self.part = Timeline()
+        else:
+            self.part = Counter()
+
+    def add(self, parsed):
+        mode = self.mode
+        if mode == 'entries':
+            self.part.append(self.format(parsed))
+        elif mode == 'latency':
+            if parsed['request_time'] is None and parsed['upstream_time'] is None:
+                return
+            route = normalize_route(parsed['url'])
+            sketches = self.part.get(route)
+            if sketches is None:
+                sketches = self.part[route] = {field: QuantileSketch() for field in LATENCY_FIELDS}
+            for field in LATENCY_FIELDS:
+                if parsed[field] is not None:
+                    sketches[field].add(parsed[field])
+        elif mode == 'histogram':
+            self.part.add(parsed)
+        else:
+            field = mode[4:]
+            value = normalize_route(parsed['url']) if field == 'route' else parsed[field]
+            self.part[value] += 1
+
+    def format(self, parsed):
+        if self.output == 'raw':
+            return parsed['raw'].rstrip('\n')
+        row = dict(parsed, time=datetime.fromtimestamp(parsed['sort_time']).strftime('%Y-%m-%d %H:%M:%S'))
+        if self.output == 'json':
+            return json.dumps({column: row.get(column) for column in BATCH_COLUMNS}, ensure_ascii=False)
+        return '\t'.join(tsv_value(row.get(column)) for column in BATCH_COLUMNS)
+
+    def take(self):
+        part = self.part.minutes if self.mode == 'histogram' else self.part
+        self.reset()
+        return part
+
+    def merge(self, part, out):
+        """Сливает часть от исполнителя; записи сразу уходят в out. False - лимит набран"""
+        if self.mode == 'entries':
+            if self.limit is not None:
+                part = part[:self.limit - self.printed]
+            if part:
+                out.write('\n'.join(part) + '\n')
+            self.printed += len(part)
+            return self.limit is None or self.printed < self.limit
+        if self.mode == 'latency':
+            for route, sketches in part.items():
+                target = self.part.setdefault(route, {field: QuantileSketch() for field in LATENCY_FIELDS})
+                for field in LATENCY_FIELDS:
+                    target[field].merge(sketches[field])
+        elif self.mode == 'histogram':
+            self.part.merge(part)
+        else:
+            self.part.update(part)
+        return True
+
+    def rows(self, start=None, end=None):
+        """Строки итогового агрегата (для записей - ничего, они уже напечатаны)"""
+        if self.mode == 'latency':
+            ranked = sorted(self.part.items(), key=lambda item: -item[1]['request_time'].count)
+            for route, sketches in ranked[:self.limit or 20]:
+                row = {'route': route, 'count': sketches['request_time'].count}
+                for field in LATENCY_FIELDS:
+                    for name, value in sketches[field].summary().items():
+                        row[f'{field}_{name}'] = value
+                yield row
+        elif self.mode == 'histogram':
+            data = self.part.buckets(start, end, self.limit or 120)
+            for t, total, c4, c5 in data['points']:
+                yield {'time': datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S'),
+                       'requests': total, '4xx': c4, '5xx': c5}
+        elif self.mode != 'entries':
+            total = sum(self.part.values()) or 1
+            for value, count in self.part.most_common(self.limit or 10):
+                yield {'value': value, 'count': count, 'share': round(count / total, 4)}
+
+    def finish(self, out, header=False, start=None, end=None):
+        first = True
+        for row in self.rows(start, end):
+            if self.output == 'json':
+                out.write(json.dumps(row, ensure_ascii=False) + '\n')
+                continue
+            if first and header:
+                out.write('\t'.join(row) + '\n')
+            first = False
+            out.write('\t'.join(tsv_value(value) for value in row.values()) + '\n')
+
+def tsv_value(value):
+    if value is None:
+        return '-'
+    if isinstance(value, float):
+        return f'{value:.3f}'
+    return str(value).replace('\t', ' ').replace('\n', ' ')
+
+def batch_scan(task):
+    """Кусок файла (или блок распакованного .gz) -> часть отчёта; выполняется в исполнителе"""
+    name, path, data, lo, hi, params, report = task
+    query = LogQuery(params)
+    start_t, end_t = query.time_range()
+    patterns = query.patterns()
+    mm = None
+    try:
+        if data is None:
+            buf = mm = open_mmap(path)
+        else:
+            buf, lo, hi = data, 0, len(data)
+        if patterns:
+            spans = match_spans(buf, patterns, lo, hi)
+        else:
+            spans = line_spans(buf, lo, hi)
+        for start, end in spans:
+            parsed = parse_log_line(buf[start:end].decode('utf-8', errors='replace') + '\n')
+            if not parsed:
+                continue
+            if start_t is not None and parsed['sort_time'] < start_t:
+                continue
+            if end_t is not None and parsed['sort_time'] > end_t:
+                continue
+            parsed['source'] = name
+            report.add(parsed)
+    finally:
+        if mm is not None:
+            mm.close()
+    return report.take()
+
+def line_spans(buf, lo, hi):
+    """(начало, конец) всех строк в [lo, hi)"""
+    while lo < hi:
+        end = buf.find(b'\n', lo, hi)
+        if end < 0:
+            end = hi
+        yield lo, end
+        lo = end + 1
+
+def batch_tasks(paths, params, report, start=None, end=None):
+    """Нарезает файлы на куски по строкам; .gz распаковывается здесь блоками"""
+    for name, path in paths.items():
+        if path.endswith('.gz'):
+            with gzip.open(path, 'rb') as f:
+                while True:
+                    block = f.read(batch_chunk_bytes)
+                    if not block:
+                        break
+                    yield name, path, block + f.readline(), 0, 0, params, report
+            continue
+        mm = open_mmap(path)
+        if mm is None:
+            continue
+        with mm:
+            lo, hi = 0, mm.rfind(b'\n') + 1
+            # Интервал времени режется бинарным поиском ещё до исполнителей
+            if start is not None:
+                lo = bisect_time(mm, start, lo, hi)
+            if end is not None:
+                hi = bisect_time(mm, end, lo, hi, after=True)
+            while lo < hi:
+                stop = mm.find(b'\n', min(lo + batch_chunk_bytes, hi) - 1, hi) + 1 or hi
+                yield name, path, None, lo, stop, params, report
+                lo = stop
+
+def bounded_map(executor, fn, tasks, window):
+    """Как executor.map, но в полёте не больше window задач: блоки .gz не копятся в памяти"""
+    pending = deque()
+    for task in tasks:
+        pending.append(executor.submit(fn, task))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def parse_cli_status(value):
+    """Статус из командной строки: код или класс (4xx, 5XX); неизвестный - ошибка, а не пустой фильтр"""
+    value = value.lower()
+    if status_bytes_pattern(value) is None:
+        raise argparse.ArgumentTypeError(f'не понимаю статус: {value} (нужно 404, 4xx, 5xx)')
+    return value
+
+def parse_cli_time(value):
+    """Время из командной строки: ЧЧ:ММ (сегодня), ДД.ММ.ГГГГ ЧЧ:ММ, ISO или unix-время"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M',
+                '%d.%m.%Y %H:%M:%S', '%d.%m.%Y %H:%M', '%d/%b/%Y:%H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt).timestamp()
+        except ValueError:
+            pass
+    for fmt in ('%H:%M:%S', '%H:%M'):
+        try:
+            t = datetime.strptime(value, fmt).time()
+            return datetime.combine(datetime.now().date(), t).timestamp()
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f'не понимаю время: {value}')
+
+def run_batch(args, paths):
+    """Пакетный режим: фильтры и агрегаты по файлам, результат в stdout"""
+    start = time.time() - args.minutes * 60 if args.minutes else args.since
+    end = args.until
+    params = {'q': args.grep, 'icase': '1' if args.ignore_case else None,
+              'status': args.status, 'ip': args.ip, 'method': args.method,
+              'start': start, 'end': end}
+    params = {name: str(value) for name, value in params.items() if value is not None}
+    if args.top:
+        mode = f'top:{args.top}'
+    elif args.latency:
+        mode = 'latency'
+    elif args.histogram:
+        mode = 'histogram'
+    else:
+        mode = 'entries'
+    report = BatchReport(mode, args.output, args.limit)
+    if mode == 'entries' and args.header and args.output == 'tsv':
+        sys.stdout.write('\t'.join(BATCH_COLUMNS) + '\n')
+    
+    tasks = batch_tasks(paths, params, BatchReport(mode, args.output), start, end)
+    first = list(islice(tasks, 2))
+    tasks = chain(first, tasks)
+    executor = None
+    if len(first) < 2 or args.jobs <= 1:
+        # Один кусок - без пула процессов, старт как у обычного скрипта
+        results = map(batch_scan, tasks)
+    else:
+        executor = ProcessPoolExecutor(args.jobs)
+        results = bounded_map(executor, batch_scan, tasks, args.jobs * 2)
+    try:
+        for part in results:
+            if not report.merge(part, sys.stdout):
+                break
+        report.finish(sys.stdout, args.header, start, end)
+        sys.stdout.flush()
+    except BrokenPipeError:
+        # Читатель (head, less) закрыл канал - это штатное завершение
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
 def main():
+    global port, store, max_history, alert_threshold, alert_warmup, alert_min_count
+    parser = argparse.ArgumentParser(description='Nginx Log Analyzer Pro')
+    parser.add_argument('logs', nargs='*', metavar='[ИМЯ=]ПУТЬ',
+                        help=f'лог-файлы (по умолчанию {DEFAULT_LOG_FILE})')
+    parser.add_argument('--port', type=int, default=port)
+    parser.add_argument('--upstream', action='append', default=[], metavar='[ИМЯ=]URL',
+                        help='режим сборщика: вьювер на другом узле, например http://edge1:8080')
+    parser.add_argument('--reorder-delay', type=float, default=reorder_delay,
+                        help='макс. задержка упорядочивания строк от узлов, сек')
+    parser.add_argument('--max-history', type=int, default=max_history,
+                        help='сколько последних записей держать в памяти на источник')
+    parser.add_argument('--db', metavar='ПУТЬ',
+                        help='SQLite-хранилище для долгой истории и быстрого перезапуска')
+    parser.add_argument('--db-retention-days', type=int, default=store_retention_days,
+                        help='сколько дней хранить записи в базе')
+    parser.add_argument('--alert-threshold', type=float, default=alert_threshold,
+                        help='порог алерта о всплеске, в сигмах от базовой линии')
+    parser.add_argument('--alert-warmup', type=int, default=alert_warmup,
+                        help='минут наблюдения ряда до первых алертов')
+    parser.add_argument('--alert-min-count', type=int, default=alert_min_count,
+                        help='минимум событий в минуте, чтобы рост считался всплеском')
+    parser.add_argument('--replay-alerts', action='store_true',
+                        help='прогнать лог-файлы через детекторы, напечатать алерты и выйти')
+    parser.add_argument('--bench-wire', action='store_true',
+                        help='сравнить размер JSON и компактного формата и выйти')
+    batch = parser.add_argument_group('пакетный режим', 'запрос к файлам (в т.ч. .gz) без веб-сервера, результат в stdout')
+    batch.add_argument('--batch', action='store_true', help='выполнить запрос и выйти')
+    batch.add_argument('--grep', metavar='ТЕКСТ', help='подстрока в строке (с учётом регистра)')
+    batch.add_argument('-i', '--ignore-case', action='store_true', help='--grep без учёта регистра (медленнее)')
+    batch.add_argument('--status', type=parse_cli_status, help='код или класс: 404, 4xx, 5xx')
+    batch.add_argument('--ip', help='IP или его часть')
+    batch.add_argument('--method', help='GET, POST, ...')
+    batch.add_argument('--since', type=parse_cli_time, metavar='ВРЕМЯ',
+                       help='начало: 02:00, "19.10.2026 02:00", ISO или unix-время')
+    batch.add_argument('--until', type=parse_cli_time, metavar='ВРЕМЯ', help='конец, формат как у --since')
+    batch.add_argument('--minutes', type=int, help='последние N минут')
+    batch.add_argument('--top', choices=BATCH_TOP_FIELDS, metavar='ПОЛЕ',
+                       help=f'топ значений поля ({", ".join(BATCH_TOP_FIELDS)})')
+    batch.add_argument('--latency', action='store_true', help='p50/p95/p99 по маршрутам')
+    batch.add_argument('--histogram', action='store_true', help='запросы и 4xx/5xx по корзинам времени')
+    batch.add_argument('--limit', type=int, help='макс. строк записей или топа; для --histogram - желаемое число корзин')
+    batch.add_argument('--output', choices=('tsv', 'json', 'raw'), default='tsv',
+                       help='TSV, JSON Lines или исходные строки лога (raw)')
+    batch.add_argument('--header', action='store_true', help='строка заголовка в TSV')
+    batch.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='процессов-исполнителей')
+    args = parser.parse_args()
+    if args.batch:
+        # Сразу к файлам: без источников, тейлера, базы и HTML-шаблона
+        run_batch(args, parse_source_specs(args.logs or [DEFAULT_LOG_FILE]))
+        return
+    port = args.port
+    max_history = args.max_history
+    reorder_buffer.delay = args.reorder_delay
+    alert_threshold = args.alert_threshold
+    alert_warmup = args.alert_warmup
+    alert_min_count = args.alert_min_count
+    if args.db:
+        store = EntryStore(args.db, args.db_retention_days)
+    
+    logs = args.logs or ([] if args.upstream else [DEFAULT_LOG_FILE])
+    local = parse_source_specs(logs)
+    if args.replay_alerts:
+        replay_alerts(local)
+        return
+    remote = parse_source_specs(args.upstream, taken=local)
+    for name, path in local.items():
+        sources[name] = LogSource(name, path)
+    for name, url in remote.items():
+        sources[name] = RemoteSource(name, url)
+    for src in sources.values():
+        src.load()
+    if args.bench_wire:
+        bench_wire()
+        return
+    threading.Thread(target=tail_loop, daemon=True).start()
+    
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     server.bind(('0.0.0.0', port))
     server.listen(10)
     
     print(f'\n🚀 Nginx Log Analyzer Pro запущен!')
-    print(f'📁 Файл: {log_file}')
+    for name, src in sources.items():
+        print(f'📁 {name}: {src.path}')
     print(f'🌐 Открой в браузере: http://localhost:{port}')
     print(f'\n✨ Новые возможности:')
     print('   • Все статусы ответов из лога')
@@ -1008,19 +4534,42 @@ def main():
     print('   • Произвольный интервал времени')
     print('   • Загрузка ВСЕГО лог-файла')
     print('   • Экспорт в CSV')
+    print('   • Несколько логов в одном процессе с общим тейлером')
+    print('   • Режим сборщика: --upstream http://узел:порт')
+    print('   • Топ IP/URL/реферов/агентов за окно (Space-Saving)')
+    print('   • p50/p95/p99 $request_time/$upstream_response_time по маршрутам')
+    print('   • Компактный формат передачи (?format=compact)')
+    print('   • Поиск по всему файлу через mmap (/search)')
+    print('   • Таймлайн запросов и ошибок с выделением интервала')
+    print('   • Поток SSE без блокировок: пульс и отключение зависших клиентов')
+    print('   • Полная строка, referer и agent по клику (/detail), в памяти только колонки таблицы')
+    print('   • Классы клиентов по User-Agent: фильтр ботов и разбивка по семействам')
+    print(f'   • Самые активные IP за окно до {client_window_minutes} мин (/clients)')
+    print(f'   • Алерты о всплесках 5xx/запросов/IP/маршрутов (порог {alert_threshold}σ, /alerts)')
+    if store is not None:
+        print(f'   • История в базе {store.path} ({args.db_retention_days} дн.)')
     print('\n⏎ Ctrl+C для остановки\n')
     
+    routes = {
+        '/stream': handle_stream,
+        '/full-log': handle_full_log,
+        '/worker.js': handle_worker,
+        '/top': handle_top,
+        '/search': handle_search,
+        '/latency': handle_latency,
+        '/histogram': handle_histogram,
+        '/alerts': handle_alerts,
+        '/detail': handle_detail,
+        '/clients': handle_clients,
+    }
+    
     try:
         while True:
             client, addr = server.accept()
+            # Запрос читается уже в потоке соединения: медленный клиент
+            # или большое тело POST не задерживают accept
             try:
-                request = client.recv(1024).decode()
-                if '/stream' in request:
-                    threading.Thread(target=handle_stream, args=(client,)).start()
-                elif '/full-log' in request:
-                    threading.Thread(target=handle_full_log, args=(client,)).start()
-                else:
-                    threading.Thread(target=handle_client, args=(client,)).start()
+                threading.Thread(target=serve_client, args=(client, routes), daemon=True).start()
             except:
                 client.close()
     except KeyboardInterrupt:
@@ -1029,4 +4578,4 @@ def main():
         server.close()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()